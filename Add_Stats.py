@@ -1,280 +1,634 @@
-from bs4 import BeautifulSoup
-from datetime import datetime
-import pandas as pd
-import numpy as np
-import requests
-import pickle
-import json
-import time
-import re
-
-dops = pd.read_csv('Scrubbed_CSV.csv', encoding='latin1')
-
-def parse_id(string):
-    '''
-    With search suggestion data returned by NHL.com we can parse
-    the player's NHL ID number
-    '''
-    if len(string) < 10:
-        return None, None, None
-    else:
-        parse = re.compile(r'''
-                   (?:p\|)
-                   (\d*)
-                   (?:\|)
-                   (\w+)
-                   (?:\|)
-                   (\w+)
-                   .*
-                   ''',re.VERBOSE)
-        parsed = parse.search(string)
-        try:
-            id_num = parsed.group(1)
-            l_name = parsed.group(2)
-            f_name = parsed.group(3)
-        except AttributeError:
-            return "Error", "Error", "Error"
-        return id_num, f_name, l_name
-
-def nhl_scrape():
-    dops['vic_nhl_id'] = ''
-    dops['off_nhl_id'] = ''
-    
-    for index, row in dops.iterrows():
-        time.sleep(1)
-        if type(row['vic_last_name']) is float:
-            continue
-        else:
-            start_trio = row['vic_last_name'][0:3].lower()
-            r = requests.get('https://suggest.svc.nhl.com/svc/suggest/v1/min_all/'
-                     + start_trio + '/99999')
-            result = json.loads(r.text)
-            for ply in result['suggestions']:
-                id_num, f_name, l_name = parse_id(ply)
-                if (f_name == row['vic_first_name'] and
-                    l_name == row['vic_last_name']):
-                    dops.set_value(index, 'vic_nhl_id', id_num)
-                    break
-                            
-                else:
-                    print('NO MATCH')
-                    
-        if type(row['off_last_name']) is float:
-            continue
-        else:
-            start_trio = row['off_last_name'][0:3].lower()
-            r = requests.get('https://suggest.svc.nhl.com/svc/suggest/v1/min_all/'
-                     + start_trio + '/99999')
-            result = json.loads(r.text)
-            for ply in result['suggestions']:
-                id_num, f_name, l_name = parse_id(ply)
-                if (f_name == row['off_first_name'] and
-                    l_name == row['off_last_name']):
-                    print(index, id_num, f_name, l_name)
-                    dops.set_value(index, 'off_nhl_id', id_num)
-                    break
-                            
-                else:
-                    continue
-
-'''
-The below is for hockey-reference.com
-The following will capture 
-'''
-def get_href_id(row, offender=True):
-    '''
-    Input DataFrame row
-    Return identifiers for Hockey-Reference Scraping
-    '''
-    if offender == True:
-        last_name = 'off_last_name'
-        first_name = 'off_first_name'
-    elif offender == False:
-        last_name = 'vic_last_name'
-        first_name = 'vic_first_name'
-    
-    new_year_months = [1,2,3,4,5,6]
-        
-    year = row['off_year']
-
-    if row['off_month'] not in new_year_months:
-        year += 1
-    
-    if type(row[last_name]) is float:
-        return None, None, None
-    else:
-        id_ref = (row[last_name][0:5].lower() +\
-                  row[first_name][0:2].lower()+\
-                     '01')
-        init_let = id_ref[0]
-            
-    return init_let, id_ref, year
-            
-   
-def hockey_ref_scrape(values):
-    '''
-    Input hockey reference player ID information
-    Returns gamelog table for year of incident
-    '''
-    init_let = values[0]
-    id_ref = values[1]
-    year = values[2]
-    
-    if init_let == None or id_ref == None or year == None:
-        return None, None, None
-    
-    url = 'http://www.hockey-reference.com/players/'+\
-            init_let + '/'+ id_ref + '/gamelog/'+ str(year)
-    r = requests.get(url)
-    soup = BeautifulSoup(r.text, "lxml")
-    
-    table = soup.find_all('table',{'class':'row_summable'}) 
-    
-    return table[0]    
-
-def parse_table(table, off_date):
-    '''
-    '''
-    global new_cols
-    
-    rows = table.find_all('tr', {"id":re.compile(r'.*')})
-    stat_dict = create_headers(rows[2])
-    if new_cols == False:
-        create_new_df_columns(rows[2])
-        
-    for row in rows:
-        
-        # Check if the game is before(or on) or after the offending date
-        game_date = row.find_next('td', {'data-stat':'date_game'}).text
-        good_date = date_checker(game_date, off_date)
-                                
-        if good_date:
-            print(stat_dict)
-            stat_dict = get_stats(stat_dict, row)
-            print(stat_dict)
-            print (''.center(20, '.'))
-        else:
-            return stat_dict
-        
-    return stat_dict
-        
-def create_headers(row):
-    '''
-    Input row of data.
-    Parses the names of the categories we'd like to keep
-    Returns a prepared dictionary
-    '''
-    stat_dict = {}
-    skip = skip_headers()
-    
-    for datum in row:        
-        if datum['data-stat'] in skip:
-            continue
-        else:
-            stat_dict.setdefault(datum['data-stat'],0)
-            
-    return stat_dict
-
-def skip_headers():
-    '''
-    Returns a list of the headers to be skipped when creating and updating
-    the stats dictionary
-    '''
-    skip = ['ranker','date_game', 'team_id', 'game_location',
-                'opp_id', 'game_result', 'shot_pct', 
-                'faceoff_percentage_all']
-    return skip
-            
-def date_checker(game_date, off_date):
-    '''
-    Input date of the game, and the date of suspension offense
-    Returns True is the game is the same day or before offense
-    Returns False if the game is after the suspension event
-    '''
-    off_date = datetime.strptime(off_date, '%Y-%m-%d')
-    game_date = datetime.strptime(game_date, '%Y-%m-%d')
-    
-    if game_date <= off_date:
-        return True
-    else:
-        return False
-    
-def get_stats(stat_dict, row):
-    '''
-    Input a row and the stat dictionary
-    Parses the new values and adds them to the dictionary values
-    Returns the dictionary
-    '''
-    skip = skip_headers()
-    special = ['age', 'time_on_ice']
-    
-    for td in row.find_all('td'):
-        stat = td['data-stat']
-        if stat not in skip and stat not in special:
-            stat_dict[stat] += int(td.text)
-        elif stat == 'time_on_ice':
-            toi = re.search(r'(\d{1,2}):?(\d{1,2})',td.text)
-            toi_min = int(toi.group(1))
-            toi_sec = int(toi.group(2))
-            stat_dict[stat] = ((toi_min * 60) + toi_sec)
-        elif stat == 'age':
-            stat_dict[stat] = td.text
-                     
-    return stat_dict   
-
-# Step 1: Get player ID
-# Step 2: Scrape player's gamelog table
-# Step 3: Collect season stats prior to offense date
-#   Step 3b: Deal with Preseason offenses (like Shaw's, dops.loc[1])
-# Step 4: Extract stat dictionaries into pandas DataFrame
-
-def create_new_df_columns(row):
-    '''
-    Inserts new columns into dops dataframe
-    '''
-    
-    global new_cols
-    
-    col_prefix = ['off_', 'vic_']
-    
-    skip = skip_headers()
-    for prefix in col_prefix:
-        for datum in row:
-            if datum['data-stat'] in skip:
-                continue
-            else:
-                string = prefix + datum['data-stat']
-                dops[string] = 0
-    
-    
-    new_cols = True
-    
-def stats_to_dataframe(off_stat, vic_stat, index):
-    '''
-    Input stats
-    Add stats into dataframe
-    '''
-    off_keys = list(map(lambda stat: 'off_' + stat, off_stat.keys()))
-    off_vals = [v for v in off_stats.values()]
-    for x in zip(off_keys, off_vals):
-        
-    
-        
-    
-new_cols = False
-for index, row in dops.loc[0:1].iterrows():
-    print(index)
-    print(row['off_date'])
-    print(row['off_last_name'])    
-    
-    off_table = hockey_ref_scrape(get_href_id(row, offender=True))
-    
-    if table:
-        off_stats = parse_table(off_table, row['off_date'])
-    else: 
-        off_stats = None
-    
-    #table = hockey_ref_scrape(get_href_id(row, offender=True))
-
-    
-
+from bs4 import BeautifulSoup
+import pandas as pd
+import numpy as np
+import pickle
+import json
+import sys
+import time
+import os
+import re
+import requests
+from concurrent.futures import ProcessPoolExecutor
+
+from Instrumentation import timed, count_cache
+from Name_Parser import fold_name, fold_column
+from Request_Scheduler import shared_scheduler
+from Storage import SCRUBBED, STATS, save_frame, load_frame
+
+SUGGEST_URL = 'https://suggest.svc.nhl.com/svc/suggest/v1/min_all/{}/99999'
+
+# Suggest responses are kept on disk for a week
+SUGGEST_CACHE = 'suggest_cache.json'
+SUGGEST_TTL = 7 * 24 * 60 * 60
+
+# NHL IDs by player name, built from the suggest responses
+PLAYER_DIRECTORY = 'player_directory.json'
+
+# Parsed hockey-reference gamelogs, one Parquet file per player-season
+GAMELOG_DIR = 'gamelogs'
+
+# Game-by-game stats of every skater in a season, from the NHL stats API
+LEAGUE_URL = ('https://api.nhle.com/stats/rest/en/skater/summary'
+              '?isAggregate=false&isGame=true&start={start}&limit={limit}'
+              '&cayenneExp=seasonId={season}%20and%20gameTypeId=2')
+LEAGUE_PAGE_SIZE = 10000
+LEAGUE_DIR = 'league_games'
+
+# Stats API fields and the hockey-reference data-stat each one stands for
+LEAGUE_STATS = {'goals':'goals', 'assists':'assists', 'points':'points',
+                'plusMinus':'plus_minus', 'penaltyMinutes':'pen_min',
+                'ppGoals':'goals_pp', 'shGoals':'goals_sh',
+                'gameWinningGoals':'goals_gw', 'shots':'shots',
+                'timeOnIcePerGame':'time_on_ice'}
+
+def parse_id(string):
+    '''
+    With search suggestion data returned by NHL.com we can parse
+    the player's NHL ID number
+    '''
+    if len(string) < 10:
+        return None, None, None
+    else:
+        parse = re.compile(r'''
+                   (?:p\|)
+                   (\d*)
+                   (?:\|)
+                   (\w+)
+                   (?:\|)
+                   (\w+)
+                   .*
+                   ''',re.VERBOSE)
+        parsed = parse.search(string)
+        try:
+            id_num = parsed.group(1)
+            l_name = parsed.group(2)
+            f_name = parsed.group(3)
+        except AttributeError:
+            return "Error", "Error", "Error"
+        return id_num, f_name, l_name
+
+def plan_prefixes(dops):
+    '''
+    Returns every distinct name prefix we need suggestions for, for both
+    victims and offenders. The suggest service is searched by the first
+    three letters of a name.
+    '''
+    names = pd.concat([dops['vic_last_name'], dops['off_last_name']])
+    return set(names.dropna().str[0:3].str.lower())
+
+
+class SuggestCache(object):
+    '''
+    Suggest responses saved on disk by name prefix. Entries older than
+    ttl seconds are fetched again.
+    '''
+    
+    def __init__(self, path=SUGGEST_CACHE, ttl=SUGGEST_TTL):
+        self.path = path
+        self.ttl = ttl
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+            
+    def get(self, prefix):
+        '''
+        Returns the cached suggestions for prefix, or None if there are
+        none or they have expired
+        '''
+        entry = self.entries.get(prefix)
+        if entry is None or time.time() - entry['fetched'] > self.ttl:
+            return None
+        return entry['suggestions']
+    
+    def put(self, prefix, suggestions):
+        self.entries[prefix] = {'fetched':time.time(),
+                                'suggestions':suggestions}
+        
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.entries, f)
+            
+
+def fetch_suggestions(prefixes, cache, scheduler=None):
+    '''
+    Downloads the suggestions for every prefix the cache doesn't already
+    have, one request per prefix, at the rate the scheduler allows
+    '''
+    scheduler = scheduler or shared_scheduler()
+    missing = {SUGGEST_URL.format(prefix):prefix for prefix in prefixes
+               if cache.get(prefix) is None}
+    count_cache('suggest', hits=len(prefixes) - len(missing),
+                misses=len(missing))
+    for suggest_url, r in scheduler.get_all(missing):
+        cache.put(missing[suggest_url], json.loads(r.text)['suggestions'])
+    cache.save()
+
+def split_suggestion(string):
+    '''
+    Splits one suggestion ('p|<id>|<last>|<first>|...') into its NHL ID,
+    first name and last name, or returns None if it isn't a player.
+    Unlike parse_id this keeps names with hyphens and apostrophes whole.
+    '''
+    fields = string.split('|')
+    if len(fields) < 4 or fields[0] != 'p':
+        return None
+    return fields[1], fields[3], fields[2]
+
+def player_key(first_name, last_name):
+    return fold_name(first_name) + '|' + fold_name(last_name)
+
+
+class PlayerDirectory(object):
+    '''
+    NHL IDs keyed by folded (first, last) names, built by parsing each
+    suggestion feed once. Saved between runs along with the time each
+    feed was fetched, so a feed is only parsed again after it is
+    refreshed.
+    '''
+    
+    def __init__(self, path=PLAYER_DIRECTORY):
+        self.path = path
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            self.ids = saved['ids']
+            self.feeds = saved['feeds']
+        except FileNotFoundError:
+            self.ids = {}
+            self.feeds = {}
+            
+    def add_feed(self, prefix, entry):
+        '''
+        Input a prefix and its SuggestCache entry
+        '''
+        if self.feeds.get(prefix) == entry['fetched']:
+            return
+        for ply in entry['suggestions']:
+            player = split_suggestion(ply)
+            if player is not None:
+                id_num, f_name, l_name = player
+                # Keep the first player of a name, as the old scan did
+                self.ids.setdefault(player_key(f_name, l_name), id_num)
+        self.feeds[prefix] = entry['fetched']
+        
+    def lookup(self, first_names, last_names):
+        '''
+        Returns the NHL ID for every row of the name columns, '' where the
+        name isn't in the directory
+        '''
+        keys = fold_column(first_names) + '|' + fold_column(last_names)
+        return keys.map(self.ids).fillna('')
+    
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'ids':self.ids, 'feeds':self.feeds}, f)
+            
+
+@timed('stats.nhl_ids', rows=len)
+def nhl_scrape(dops, cache=None, directory=None):
+    '''
+    Fills in vic_nhl_id and off_nhl_id. Every name prefix is only
+    requested once, and not at all while its cached response is fresh.
+    Names are then matched through the player directory.
+    '''
+    cache = cache or SuggestCache()
+    directory = directory or PlayerDirectory()
+    prefixes = plan_prefixes(dops)
+    fetch_suggestions(prefixes, cache)
+    for prefix in prefixes:
+        directory.add_feed(prefix, cache.entries[prefix])
+    directory.save()
+    
+    for who in ('vic', 'off'):
+        dops[who + '_nhl_id'] = directory.lookup(dops[who + '_first_name'],
+                                                 dops[who + '_last_name'])
+    return dops
+
+'''
+The below is for hockey-reference.com
+The following will capture 
+'''
+def gamelog_url(init_let, id_ref, year):
+    return 'http://www.hockey-reference.com/players/'+\
+            init_let + '/'+ id_ref + '/gamelog/'+ str(year)
+
+def gamelog_table(html):
+    '''
+    Returns the gamelog table of a hockey-reference page, or None if the
+    page doesn't have one
+    '''
+    soup = BeautifulSoup(html, "lxml")
+    table = soup.find_all('table',{'class':'row_summable'}) 
+    return table[0] if table else None
+
+@timed('stats.gamelog_frame', rows=len)
+def gamelog_frame(table):
+    '''
+    Input a gamelog table
+    Returns one row per game: date_game as a date, the counting stats as
+    the smallest integer type that holds them, time_on_ice in seconds and
+    the rest as text
+    '''
+    if table is None:
+        return pd.DataFrame({'date_game':pd.Series(dtype='datetime64[ns]')})
+    
+    games = pd.DataFrame([{cell['data-stat']:cell.text 
+                           for cell in row.find_all(['th', 'td'])
+                           if cell.has_attr('data-stat')}
+                          for row in table.find_all('tr', {"id":re.compile(r'.*')})])
+    games = games.drop(columns=['ranker'], errors='ignore')
+    if games.empty:
+        return pd.DataFrame({'date_game':pd.Series(dtype='datetime64[ns]')})
+    
+    games['date_game'] = pd.to_datetime(games['date_game'], format='%Y-%m-%d')
+    if 'time_on_ice' in games:
+        toi = games['time_on_ice'].str.extract(r'(\d{1,2}):?(\d{1,2})')
+        toi = toi.astype(float).fillna(0)
+        games['time_on_ice'] = pd.to_numeric(toi[0] * 60 + toi[1],
+                                             downcast='integer')
+    for stat in stat_columns(games):
+        games[stat] = pd.to_numeric(pd.to_numeric(games[stat], errors='coerce')
+                                    .fillna(0), downcast='integer')
+    return games
+
+def merge_dates(dates):
+    '''
+    Dates as merge_asof keys. Dates parsed from text and from Timestamps
+    can come out in different units, which merge_asof won't match.
+    '''
+    return pd.to_datetime(dates).astype('datetime64[ns]')
+
+def stat_columns(games):
+    '''
+    The counting stats of a gamelog, the ones summed over the season
+    '''
+    special = ['age', 'time_on_ice']
+    return [col for col in games.columns
+            if col not in skip_headers() and col not in special]
+
+def zero_fill(stats):
+    '''
+    Fills the counting stats a source gave no games for with zeros and
+    shrinks them to the smallest integer type
+    '''
+    for stat in stat_columns(stats):
+        stats[stat] = pd.to_numeric(stats[stat].fillna(0), downcast='integer')
+    return stats
+
+class GamelogStore(object):
+    '''
+    Parsed gamelogs keyed by (hockey-reference ID, season). Each page is
+    only fetched once: after that it is read from a Parquet file in
+    directory, and after the first read it is served from memory.
+    '''
+    
+    def __init__(self, directory=GAMELOG_DIR, scheduler=None):
+        self.directory = directory
+        self.fetcher = scheduler
+        self.games = {}
+        os.makedirs(directory, exist_ok=True)
+    
+    @property
+    def scheduler(self):
+        '''
+        Only made when a page has to be fetched, so a store that just
+        reads its files, as in a worker process, never starts one
+        '''
+        if self.fetcher is None:
+            self.fetcher = shared_scheduler()
+        return self.fetcher
+        
+    def path(self, id_ref, year):
+        return os.path.join(self.directory, '{}_{}.parquet'.format(id_ref, year))
+    
+    def cached(self, id_ref, year):
+        '''
+        Returns the gamelog if it's in memory or on disk, else None
+        '''
+        key = (id_ref, int(year))
+        if key not in self.games and os.path.exists(self.path(*key)):
+            self.games[key] = pd.read_parquet(self.path(*key))
+            count_cache('gamelogs', hits=1)
+        return self.games.get(key)
+    
+    def add(self, id_ref, year, html):
+        key = (id_ref, int(year))
+        count_cache('gamelogs', misses=1)
+        self.games[key] = gamelog_frame(gamelog_table(html))
+        self.games[key].to_parquet(self.path(*key))
+        return self.games[key]
+    
+    def add_response(self, id_ref, year, r):
+        '''
+        Stores a fetched gamelog page. A 404 (no such player-season) is
+        stored as an empty gamelog so it isn't asked for again. Any other
+        failure, like a 429 that outlasted the retries, raises and stores
+        nothing, so the page is fetched again next time.
+        '''
+        if r.status_code == 404:
+            return self.add(id_ref, year, '')
+        r.raise_for_status()
+        return self.add(id_ref, year, r.text)
+    
+    def get(self, init_let, id_ref, year):
+        '''
+        Returns the gamelog of one player-season, or None without an ID
+        '''
+        if init_let is None or id_ref is None or year is None:
+            return None
+        games = self.cached(id_ref, year)
+        if games is None:
+            r = self.scheduler.get(gamelog_url(init_let, id_ref, year))
+            games = self.add_response(id_ref, year, r)
+        return games
+    
+    def prefetch(self, ids):
+        '''
+        Input (init_let, id_ref, year) tuples, as href_ids gives them
+        Downloads every distinct player-season that isn't stored yet, all
+        at once through the scheduler. If some pages fail, the rest are
+        still stored before the first failure is raised.
+        '''
+        urls = {}
+        for init_let, id_ref, year in set(ids):
+            if id_ref is not None and self.cached(id_ref, year) is None:
+                urls[gamelog_url(init_let, id_ref, year)] = (id_ref, year)
+        if not urls:
+            return
+        failed = None
+        for page_url, r in self.scheduler.get_all(urls):
+            try:
+                self.add_response(*urls[page_url], r)
+            except requests.HTTPError as error:
+                failed = failed or error
+        if failed is not None:
+            raise failed
+
+def href_ids(dops, offender=True):
+    '''
+    The hockey-reference identifiers of every row's offender (or victim)
+    Returns init_let, id_ref and year columns, NaN where there's no player
+    '''
+    if offender == True:
+        last_name = dops['off_last_name']
+        first_name = dops['off_first_name']
+    else:
+        last_name = dops['vic_last_name']
+        first_name = dops['vic_first_name']
+    
+    new_year_months = [1,2,3,4,5,6]
+    id_ref = (last_name.str[0:5].str.lower() + first_name.str[0:2].str.lower()
+              + '01')
+    year = dops['off_year'] + (~dops['off_month'].isin(new_year_months)).astype(int)
+    return pd.DataFrame({'init_let':id_ref.str[0], 'id_ref':id_ref,
+                         'year':year}, index=dops.index)
+
+def season_totals(games):
+    '''
+    Input a gamelog frame
+    Returns the running season totals after every game. Age and time on
+    ice are those of the game itself.
+    '''
+    games = games.sort_values('date_game')
+    stats = stat_columns(games)
+    totals = games[stats].cumsum()
+    totals['date_game'] = games['date_game']
+    for stat in ('age', 'time_on_ice'):
+        if stat in games:
+            totals[stat] = games[stat]
+    return totals
+
+@timed('stats.pre_offense_stats', rows=len)
+def pre_offense_stats(dops, store, offender=True):
+    '''
+    Returns the offender's (or victim's) season stats up to and including
+    the day of each offense, one row per row of dops.
+    
+    Every player-season's running totals are stacked into one table and
+    matched to the offenses with a single merge_asof on the date.
+    '''
+    ids = href_ids(dops, offender)
+    ids = ids[ids.notna().all(axis=1)].astype({'year':int})
+    keys = ids.drop_duplicates()
+    store.prefetch(keys.itertuples(index=False, name=None))
+    
+    totals = []
+    for init_let, id_ref, year in keys.itertuples(index=False, name=None):
+        games = store.get(init_let, id_ref, year)
+        if len(games):
+            totals.append(season_totals(games)
+                          .assign(gamelog='{}_{}'.format(id_ref, year)))
+    if not totals:
+        return pd.DataFrame(index=dops.index)
+    totals = pd.concat(totals, ignore_index=True).sort_values('date_game')
+    totals['date_game'] = merge_dates(totals['date_game'])
+    
+    incidents = pd.DataFrame({'gamelog':ids['id_ref'] + '_' + ids['year'].astype(str),
+                              'off_date':merge_dates(dops.loc[ids.index, 'off_date']),
+                              'row':ids.index})
+    incidents = incidents.dropna(subset=['off_date']).sort_values('off_date')
+    stats = pd.merge_asof(incidents, totals, left_on='off_date',
+                          right_on='date_game', by='gamelog',
+                          direction='backward')
+    stats = (stats.set_index('row')
+             .drop(columns=['gamelog', 'off_date', 'date_game'])
+             .reindex(dops.index))
+    
+    # Offenses before a player's first game of the season count as zeros
+    return zero_fill(stats)
+
+def skip_headers():
+    '''
+    Returns a list of the headers to be skipped when creating and updating
+    the stats dictionary
+    '''
+    skip = ['ranker','date_game', 'team_id', 'game_location',
+                'opp_id', 'game_result', 'shot_pct', 
+                'faceoff_percentage_all']
+    return skip
+            
+# Step 1: Get player ID
+# Step 2: Scrape player's gamelog table
+# Step 3: Collect season stats prior to offense date
+#   Step 3b: Deal with Preseason offenses (like Shaw's, dops.loc[1])
+# Step 4: Attach the offender and victim stats to the DataFrame
+
+class LeagueGames(object):
+    '''
+    Every skater's game-by-game stats for whole seasons, from the NHL
+    stats API: a handful of requests per season instead of one per
+    player. Seasons are saved as Parquet files in directory and kept in
+    memory as running totals per player.
+    '''
+    
+    def __init__(self, directory=LEAGUE_DIR, scheduler=None):
+        self.directory = directory
+        self.scheduler = scheduler or shared_scheduler()
+        self.totals = {}
+        os.makedirs(directory, exist_ok=True)
+        
+    @timed('stats.league_fetch', rows=len)
+    def fetch(self, year):
+        '''
+        Downloads every page of the season ending in year
+        Returns one row per player and game
+        '''
+        season = '{}{}'.format(year - 1, year)
+        first = self.scheduler.get(LEAGUE_URL.format(
+                start=0, limit=LEAGUE_PAGE_SIZE, season=season)).json()
+        rows = first['data']
+        urls = [LEAGUE_URL.format(start=start, limit=LEAGUE_PAGE_SIZE,
+                                  season=season)
+                for start in range(LEAGUE_PAGE_SIZE, first['total'],
+                                   LEAGUE_PAGE_SIZE)]
+        for page_url, r in self.scheduler.get_all(urls):
+            rows.extend(r.json()['data'])
+        
+        games = pd.DataFrame(rows, columns=['playerId', 'gameDate']
+                             + list(LEAGUE_STATS))
+        games = games.rename(columns=LEAGUE_STATS)
+        games['playerId'] = games['playerId'].astype(str)
+        games['date_game'] = pd.to_datetime(games.pop('gameDate').str[0:10],
+                                            format='%Y-%m-%d')
+        for stat in LEAGUE_STATS.values():
+            games[stat] = pd.to_numeric(games[stat].fillna(0),
+                                        downcast='integer')
+        return games
+    
+    def season(self, year):
+        '''
+        Returns the running season totals of every player after each of
+        their games, sorted by date
+        '''
+        if year not in self.totals:
+            path = os.path.join(self.directory, '{}.parquet'.format(year))
+            stored = os.path.exists(path)
+            count_cache('league_seasons', hits=stored, misses=not stored)
+            if stored:
+                games = pd.read_parquet(path)
+            else:
+                games = self.fetch(year)
+                games.to_parquet(path)
+            
+            games = games.sort_values(['playerId', 'date_game'])
+            stats = stat_columns(games.drop(columns=['playerId']))
+            totals = games.groupby('playerId')[stats].cumsum()
+            totals['playerId'] = games['playerId']
+            totals['date_game'] = games['date_game']
+            totals['time_on_ice'] = games['time_on_ice']
+            totals['year'] = year
+            self.totals[year] = totals.sort_values('date_game')
+        return self.totals[year]
+    
+    @timed('stats.league_pre_offense_stats', rows=lambda found: len(found[0]))
+    def pre_offense_stats(self, dops, offender=True):
+        '''
+        Returns the stats of the offender (or victim) up to and including
+        the day of each offense, and a mask of the rows whose player isn't
+        in the season tables and needs another source
+        '''
+        who = 'off_' if offender else 'vic_'
+        if who + 'nhl_id' not in dops:
+            return (pd.DataFrame(index=dops.index),
+                    pd.Series(True, index=dops.index))
+        
+        # IDs read back from a CSV may be floats, or '' for no match
+        player_id = pd.to_numeric(dops[who + 'nhl_id'], errors='coerce')
+        incidents = pd.DataFrame({
+                'playerId':player_id.astype('Int64'),
+                'year':href_ids(dops, offender)['year'],
+                'off_date':merge_dates(dops['off_date']),
+                'row':dops.index})
+        incidents = incidents.dropna(subset=['playerId', 'year', 'off_date'])
+        incidents['playerId'] = incidents['playerId'].astype(str)
+        incidents['year'] = incidents['year'].astype(int)
+        if incidents.empty:
+            return (pd.DataFrame(index=dops.index),
+                    pd.Series(True, index=dops.index))
+        
+        totals = pd.concat([self.season(year)
+                            for year in incidents['year'].unique()],
+                           ignore_index=True).sort_values('date_game')
+        totals['date_game'] = merge_dates(totals['date_game'])
+        players = pd.MultiIndex.from_frame(
+                totals[['playerId', 'year']].drop_duplicates())
+        found = pd.MultiIndex.from_frame(
+                incidents[['playerId', 'year']]).isin(players)
+        incidents = incidents[found].sort_values('off_date')
+        
+        stats = pd.merge_asof(incidents, totals, left_on='off_date',
+                              right_on='date_game', by=['playerId', 'year'],
+                              direction='backward')
+        stats = (stats.set_index('row')
+                 .drop(columns=['playerId', 'year', 'off_date', 'date_game'])
+                 .reindex(dops.index))
+        missing = pd.Series(True, index=dops.index)
+        missing.loc[incidents['row']] = False
+        return stats, missing
+
+def stats_for_chunk(args):
+    '''
+    Input a chunk of the suspension table, whether to get offender or
+    victim stats and the directory of the gamelog store
+    Returns the stats for its rows. Gamelogs are read from the store's
+    files, so this can run in a worker process, and as nothing is fetched
+    the worker's store never makes a scheduler.
+    '''
+    chunk, offender, directory = args
+    return pre_offense_stats(chunk, GamelogStore(directory), offender)
+
+def player_stats(rows, offender, processes=0, store=None, mp_context=None):
+    '''
+    Pre-offense stats from each player's own gamelog pages.
+    All the gamelogs are downloaded first, in this process, so the
+    scheduler's rate limits hold. With processes > 0 the stats are then
+    computed over chunks of rows in parallel, on processes started with
+    mp_context (see ProcessPoolExecutor).
+    '''
+    store = store or GamelogStore()
+    ids = href_ids(rows, offender)
+    ids = ids[ids.notna().all(axis=1)].astype({'year':int})
+    store.prefetch(ids.itertuples(index=False, name=None))
+    
+    if processes and len(rows) >= processes:
+        chunks = [(rows.iloc[i::processes], offender, store.directory)
+                  for i in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=mp_context) as pool:
+            return pd.concat(pool.map(stats_for_chunk, chunks)).reindex(rows.index)
+    return pre_offense_stats(rows, store, offender)
+
+@timed('stats', rows=len)
+def attach_stats(dops, processes=0, store=None, league=None, mp_context=None):
+    '''
+    Adds the off_ and vic_ stat columns to every row of the table.
+    If league is given (a LeagueGames) the stats come from its season
+    tables, and players missing from them fall back to their own
+    gamelog pages.
+    '''
+    store = store or GamelogStore()
+    for prefix, offender in (('off_', True), ('vic_', False)):
+        rows = dops
+        stats = []
+        if league is not None:
+            bulk, missing = league.pre_offense_stats(dops, offender)
+            stats.append(zero_fill(bulk[~missing].copy()))
+            rows = dops[missing]
+        stats.append(player_stats(rows, offender, processes, store,
+                                  mp_context))
+        # Each source only zero-fills the stats it has: the ones the
+        # league tables don't carry (goals_ev, shifts...) stay NA on the
+        # rows they covered
+        stats = pd.concat(stats).reindex(dops.index)
+        dops = dops.merge(stats.add_prefix(prefix), how='left',
+                          left_index=True, right_index=True)
+    return dops
+
+
+if __name__ == '__main__':
+    dops = nhl_scrape(load_frame(SCRUBBED))
+    league = LeagueGames() if '--league' in sys.argv else None
+    dops = attach_stats(dops, processes=os.cpu_count(), league=league)
+    save_frame(dops, STATS, '--csv' in sys.argv)
@@ -0,0 +1,856 @@
+'''
+Offline benchmarks for the scraping, cleaning and stats passes. Nothing
+here touches the network: every input is generated, at a multiple of
+today's volume (eight season pages of about a thousand rows in all, and
+the suggest feeds and gamelogs that go with them).
+
+Every benchmark reports its throughput and peak memory: how far it raised
+the resident set, so what lxml and pyarrow allocate counts too (without
+/proc, only the Python heap, under tracemalloc). The results are appended
+to RESULTS_FILE and compared with the last run of the same benchmark at
+the same scale, so regressions show up between runs. Where
+a pass replaced legacy code, both are timed on the same input and the
+speed-up over the legacy code is reported too.
+
+Run with: python Benchmark.py [scale ...] [--only name,name]
+    scale   multiple of today's volume, 10 by default
+    --only  run only the named benchmarks, e.g. --only extract_lxml
+'''
+
+import ctypes
+import datetime
+import gc
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import shutil
+import time
+import tracemalloc
+from html import escape
+import pandas as pd
+
+from CSV_cleaner import (classify_offenses, parse_suspensions, parse_money,
+                         parse_dates, map_unique, re_parse_victim,
+                         clean, clean_chunks, no_overrides, CHUNK_ROWS)
+from Name_Parser import NameParser
+from NHL_Wiki_Scraper import pages, parse_page
+from Add_Stats import (parse_id, PlayerDirectory, gamelog_table,
+                       gamelog_frame, GamelogStore, pre_offense_stats)
+from Storage import save_frame, load_frame
+
+RESULTS_FILE = 'benchmarks.jsonl'
+
+# A benchmark this much slower than its last run is reported
+TOLERANCE = 0.2
+
+# Today's volume, which the scale multiplies
+TABLE_ROWS = 60   # rows in each suspension and fines table
+PLAYERS = 1000    # players in the suggest feeds
+GAMELOGS = 200    # player-seasons with a gamelog page
+GAMES = 82        # games in each gamelog
+
+# The legacy parse_id scan reads a whole feed per row, so it only gets
+# this many rows
+LEGACY_ID_ROWS = 5000
+
+# Where the benchmarks keep the memo and directory files they make
+SCRATCH_DIR = tempfile.mkdtemp(prefix='dops_bench_')
+
+
+def legacy_re_parse_offense(row):
+    '''
+    The row-by-row offense parser classify_offenses replaced, kept as the
+    reference for the parity check and the baseline for the timings
+    '''
+    re_exps = {r'.*abuse.*official' : 'Abuse of Official',
+               r'Attempt.*' : 'Attempt to Injure',
+               r'Automatic.*' : 'Automatic Suspension',
+               r'Blindsid.*' : 'Blindsiding',
+               r'Board.*' : 'Boarding',
+               r'[Bb]utt-?end.*' : 'Butt-Ending',
+               r'[Cc]harg.*' : 'Charging',
+               r'Clip.*' : 'Clipping',
+               r'([Cc]omment.*|[Cc]omplaint.*|[Gg]esture.*|[Ss]lur)' : 'Comments/Gestures',
+               r'Cross.check.*' : 'Cross-checking',
+               r'Diving.*' : 'Diving',
+               r'Elbow.*': 'Elbowing',
+               r'[Hh]ead-?butt.*' : 'Head-Butting',
+               r'High.stick.*' : 'High-Stick',
+               r'(Hit.*|Check.*) from behind':'Hitting from Behind',
+               r'Illegal( check| hit)' : 'Illegal Check',
+               r'(Inappropriate.*|conduct)' : 'Inappropriate Conduct',
+               r'([Ii]nstigat.*|[Aa]ggress.*)' : 'Instigator',
+               r'Interfer.*' : 'Interference',
+               r'Knee-on-knee.*' : 'Knee-on-knee',
+               r'([Kk]ick.*|Kneeing)' : 'Kicking or Kneeing',
+               r'([Ll]ate|[Ll]ow)?.*([Hh]it.|[Cc]heck)(to the head)?' : 'Illegal hit',# Late, low, to head
+               r'[Ll]eaving.*bench' : 'Leaving Bench',
+               r'[Pp]unch.*' : 'Punching',
+               r'Roughing.*' : 'Roughing',
+               r'Slash.*' : 'Slashing',
+               r'[Ss]lew.*' : 'Slew-footing',
+               r'Spear.*': 'Spearing',
+               r'[Tt]rip.*' : 'Tripping',
+               r'.*[Vv]iolating' : 'Drugs',
+               }
+    for k,v in re_exps.items():
+        if re.search(k, row):
+            return v
+        else:
+            continue
+    return 'NO PARSE' # Labels uncoded entries
+
+
+def legacy_re_parse_total_games(row):
+    games = re.compile(r'''
+                       (\d+)
+                       (?:\s.*)?
+                       ''', re.VERBOSE)
+    return int(re.search(games, row).group(1))
+
+def legacy_re_parse_playoff_games(row):
+    post_games = re.compile(r'''
+                          .*?
+                          (\d+)
+                          (?:\s[A-Z]{,3})?
+                          (?:\s\d{4})?
+                          \s
+                          post-season.*
+                          ''', re.VERBOSE)
+    try:
+        return int(re.search(post_games, row).group(1))
+    except AttributeError:
+        return 0
+
+def legacy_re_parse_preseason_games(row):
+    pre_games = re.compile(r'''
+                          .*?
+                          (\d+)
+                          (?:\s[A-Z]{,3})?
+                          (?:\s\d{4})?
+                          \s
+                          pre-season.*
+                          ''', re.VERBOSE)
+    try:
+        return int(re.search(pre_games, row).group(1))
+    except AttributeError:
+        return 0
+
+def legacy_money_to_float(row):
+    replacements = {"$":'', ",":""}
+    if type(row) is str:
+        try:
+            return float(''.join([replacements.get(c,c) for c in row]))
+        except ValueError:
+            try:
+                re_expr = re.compile(r'''
+                          [$]
+                          (\d+,\d+.\d+)
+                          .*?                          
+                          ''', re.VERBOSE)
+                money = re.search(re_expr, row).group(1)
+                return float(''.join([replacements.get(c,c) for c in money]))
+            except AttributeError:
+                return "ERROR"
+    else:
+        return 0
+
+
+def legacy_parse_ids(first_names, last_names, feeds):
+    '''
+    The per-row scan nhl_scrape used to do: every row reads its prefix's
+    suggest response and runs parse_id over it until the names match
+    '''
+    ids = []
+    for first, last in zip(first_names, last_names):
+        found = ''
+        result = json.loads(feeds.get(last[0:3].lower(),
+                                      '{"suggestions":[]}'))
+        for ply in result['suggestions']:
+            id_num, f_name, l_name = parse_id(ply)
+            if f_name == first and l_name == last:
+                found = id_num
+                break
+        ids.append(found)
+    return pd.Series(ids, index=first_names.index)
+
+
+# Pieces the synthetic offense descriptions are put together from
+OFFENSES = ['Boarding', 'Charging', 'Elbowing', 'Slashing', 'Spearing',
+            'Cross-checking', 'High-sticking', 'Interference', 'Roughing',
+            'Illegal check to the head of', 'Late hit on', 'Low hit on',
+            'Hit from behind on', 'Kneeing', 'Clipping', 'Head-butting',
+            'Attempt to injure', 'Butt-ending', 'Slew-footing', 'Tripping',
+            'Leaving the bench', 'Punching', 'Diving/Embellishment',
+            'Inappropriate comments made to', 'Abuse of an official',
+            'Instigator in final five minutes', 'Automatic suspension',
+            'Unsportsmanlike conduct', 'Blindsiding', 'Knee-on-knee hit on',
+            'Violating the terms of the Performance Enhancing Substances Program',
+            'Physical altercation with']
+VICTIMS = ['Sidney Crosby', 'Jonathan Toews', 'Andrew D\'Agostini',
+           'P. K. Subban', 'T.J. Oshie', 'Marc-Andre Fleury', 'Zach Parise',
+           'Erik Karlsson', 'Brad Marchand', 'Jason Zucker', '']
+
+
+def synthetic_offenses(rows, seed=2017):
+    '''
+    Returns a Series of made up offense descriptions shaped like the
+    scraped ones
+    '''
+    rand = random.Random(seed)
+    return pd.Series(['{} {}'.format(rand.choice(OFFENSES),
+                                     rand.choice(VICTIMS)).strip()
+                      for _ in range(rows)])
+# Suspension lengths in the shapes found on the season pages
+SUSPENSIONS = ['{} games', '{} game', '{} games (1 pre-season, {} regular season)',
+               '{} games (2 NHL 2014 post-season, {} regular season)',
+               '{} games ({} pre-season)', '{} post-season games', '0',
+               '{} games (3 pre-season, 1 post-season)']
+
+
+def synthetic_suspensions(rows, seed=2017):
+    '''
+    Returns a Series of made up suspension lengths
+    '''
+    rand = random.Random(seed)
+    return pd.Series([rand.choice(SUSPENSIONS).format(rand.randint(1, 20),
+                                                      rand.randint(1, 20))
+                      for _ in range(rows)])
+
+FIRST_NAMES = ['Sidney', 'Alex', 'Evgeni', 'Patrick', 'Jonathan', 'Erik',
+               'Brad', 'Zach', 'Marc', 'Ryan', 'Shea', 'Nazem', 'Tyler',
+               'Drew', 'Matt', 'Jamie', 'Logan', 'Dustin', 'Steven', 'Brent']
+SYLLABLES = ['ba', 'ker', 'son', 'mac', 'don', 'ald', 'ro', 'vich', 'ov',
+             'berg', 'stro', 'man', 'tan', 'el', 'li', 'ne', 'ham', 'pe',
+             'lan', 'ger']
+TEAMS = ['Boston Bruins', 'Pittsburgh Penguins', 'Washington Capitals',
+         'Chicago Blackhawks', 'Tampa Bay Lightning', 'Anaheim Ducks',
+         'Toronto Maple Leafs', 'Montreal Canadiens', 'Calgary Flames']
+
+# Header layouts of the season pages, named as the old scraper named
+# them: by the number of header cells in their suspension and fines
+# tables, the cells of the totals row included
+NEW_SUSP = ['Date of incident', 'Offender', 'Team', 'Offense',
+            'Date of action', 'Length', 'Salary forfeited']
+NEW_FINE = ['Date of incident', 'Offender', 'Team', 'Offense',
+            'Date of action', 'Amount']
+LAYOUTS = {
+        '10/8':(NEW_SUSP, NEW_FINE, True),
+        '11/9':(NEW_SUSP + ['Ref.'], NEW_FINE + ['Ref.'], True),
+        '6/6':(NEW_SUSP[:6], NEW_FINE, False),
+        '5/5':(['Date', 'Offender', 'Team', 'Offense', 'Length'],
+               ['Date', 'Offender', 'Team', 'Offense', 'Amount'], False),
+        }
+PAGE_LAYOUTS = {'2016':'10/8', '2015':'10/8', '2014':'10/8', '2013':'11/9',
+                '2012':'6/6', '2011':'6/6', '2010':'5/5', '2009':'5/5'}
+
+# The rest of an article, which the parsers have to get through
+FILLER = ('<p>' + 'The Department of Player Safety reviewed the play. ' * 20
+          + '</p>') * 30
+LEGEND = '<table class="wikitable"><tr><th>Key</th></tr><tr><td>*</td></tr></table>'
+
+GAMELOG_STATS = ['goals', 'assists', 'points', 'plus_minus', 'pen_min',
+                 'goals_ev', 'goals_pp', 'goals_sh', 'goals_gw', 'shots',
+                 'shot_pct', 'shifts']
+
+
+def synthetic_players(count, seed=2017):
+    '''
+    Returns (NHL ID, first name, last name) tuples for made up players
+    '''
+    rand = random.Random(seed)
+    return [(str(8470000 + n), rand.choice(FIRST_NAMES),
+             ''.join(rand.choice(SYLLABLES)
+                     for _ in range(rand.randint(2, 3))).capitalize())
+            for n in range(count)]
+
+def suggest_feeds(players):
+    '''
+    Returns the suggest response for every name prefix, as JSON text
+    '''
+    feeds = {}
+    for id_num, first, last in players:
+        feeds.setdefault(last[0:3].lower(), []).append(
+                'p|{}|{}|{}|1|0|6\' 0"|195|Toronto|ON|CAN|1990-01-01|TOR|C|19|'
+                '{}-{}-{}'.format(id_num, last, first, first.lower(),
+                                  last.lower(), id_num))
+    return {prefix:json.dumps({'suggestions':suggestions})
+            for prefix, suggestions in feeds.items()}
+
+def date_cell(day, styled):
+    text = '{:%B} {}, {}'.format(day, day.day, day.year)
+    if not styled:
+        return escape(text)
+    return ('<span style="display:none">{:%Y-%m-%d}</span>'
+            '<span style="white-space:nowrap">{}</span>'.format(day, text))
+
+def table_html(headers, totals, rows, fines, start, players, rand):
+    '''
+    One suspension (or fines) Wikitable of a season page
+    '''
+    styled = 'Date of action' in headers
+    html = ['<table class="wikitable sortable"><tr>']
+    html.extend('<th>{}</th>'.format(header) for header in headers)
+    html.append('</tr>')
+    for _ in range(rows):
+        off_date = start + datetime.timedelta(days=rand.randint(0, 180))
+        _, first, last = rand.choice(players)
+        _, vic_first, vic_last = rand.choice(players)
+        name = '{} {}'.format(first, last)
+        cells = {
+            'Date of incident':date_cell(off_date, styled),
+            'Date':date_cell(off_date, styled),
+            'Offender':('<span class="vcard"><a href="/wiki/{}">{}</a></span>'
+                        .format(last, name) if styled else name),
+            'Team':rand.choice(TEAMS),
+            'Offense':escape('{} {} {}'.format(rand.choice(OFFENSES),
+                                               vic_first, vic_last)),
+            'Date of action':date_cell(
+                    off_date + datetime.timedelta(days=rand.randint(1, 3)),
+                    styled),
+            'Length':rand.choice(SUSPENSIONS).format(rand.randint(1, 20),
+                                                     rand.randint(1, 20)),
+            'Salary forfeited':'${:,.2f}'.format(rand.randint(1000, 500000)),
+            'Amount':'${:,.2f}'.format(rand.choice([2000, 5000, 10000])),
+            'Ref.':'[{}]'.format(rand.randint(1, 200)),
+            }
+        html.append('<tr>')
+        html.extend('<td>{}</td>'.format(cells[header]) for header in headers)
+        html.append('</tr>')
+    if totals:
+        money = 'Amount' if fines else 'Salary forfeited'
+        html.append('<tr><th colspan="5">Totals</th>')
+        if not fines:
+            html.append('<th>{} games</th>'.format(rows))
+        html.append('<th>{}</th></tr>'.format(money))
+    html.append('</table>')
+    return ''.join(html)
+
+def season_pages(scale, players, seed=2017):
+    '''
+    Yields (page, html) for every season page, in the layout that
+    season's page uses, with scale times today's rows in each table
+    '''
+    rand = random.Random(seed)
+    for page in pages:
+        susp_headers, fine_headers, totals = LAYOUTS[PAGE_LAYOUTS[page[0:4]]]
+        start = datetime.date(int(page[0:4]), 10, 5)
+        rows = TABLE_ROWS * scale
+        yield page, ''.join([
+                '<html><body><h1>', escape(page), '</h1>', FILLER, LEGEND,
+                table_html(susp_headers, totals, rows, False, start,
+                           players, rand),
+                FILLER,
+                table_html(fine_headers, totals, rows, True, start,
+                           players, rand),
+                FILLER, '</body></html>'])
+
+def gamelog_page(year, rand):
+    '''
+    A hockey-reference gamelog page for one player-season
+    '''
+    html = ['<html><body><table class="row_summable sortable stats_table" '
+            'id="gamelog"><thead><tr><th data-stat="ranker">Rk</th>'
+            '<th data-stat="date_game">Date</th></tr></thead><tbody>']
+    day = datetime.date(year - 1, 10, 5)
+    for game in range(1, GAMES + 1):
+        day += datetime.timedelta(days=rand.randint(1, 3))
+        goals, assists = rand.choice([0, 0, 0, 1, 2]), rand.choice([0, 0, 1, 2])
+        shots = goals + rand.randint(0, 5)
+        stats = {'goals':goals, 'assists':assists, 'points':goals + assists,
+                 'plus_minus':rand.randint(-2, 2),
+                 'pen_min':rand.choice([0, 0, 2, 4, 5, 10]),
+                 'goals_ev':goals, 'goals_pp':0, 'goals_sh':0,
+                 'goals_gw':rand.choice([0, 0, 0, 1]) if goals else 0,
+                 'shots':shots,
+                 'shot_pct':'{:.1f}'.format(100 * goals / shots) if shots else '',
+                 'shifts':rand.randint(15, 30)}
+        html.append('<tr id="gamelog.{0}"><th data-stat="ranker">{0}</th>'
+                    '<td data-stat="date_game">{1:%Y-%m-%d}</td>'
+                    '<td data-stat="age">25-100</td>'
+                    '<td data-stat="team_id">TOR</td>'
+                    '<td data-stat="game_location">@</td>'
+                    '<td data-stat="opp_id">BOS</td>'
+                    '<td data-stat="game_result">W 3-2</td>'.format(game, day))
+        html.extend('<td data-stat="{}">{}</td>'.format(stat, stats[stat])
+                    for stat in GAMELOG_STATS)
+        html.append('<td data-stat="time_on_ice">{}:{:02d}</td></tr>'.format(
+                rand.randint(10, 24), rand.randint(0, 59)))
+        if game % 20 == 0:
+            # hockey-reference repeats the header every 20 games
+            html.append('<tr class="thead"><th data-stat="ranker">Rk</th></tr>')
+    html.append('</tbody></table></body></html>')
+    return ''.join(html)
+
+def offense_rows(player_seasons, seed=2017):
+    '''
+    Returns two offenses in every (first, last, year) player-season, with
+    the columns pre_offense_stats reads. They all come after the first
+    game of the season, so every one has stats.
+    '''
+    rand = random.Random(seed)
+    rows = []
+    for first, last, year in player_seasons:
+        for _ in range(2):
+            day = (datetime.date(year - 1, 10, 20)
+                   + datetime.timedelta(days=rand.randint(0, 170)))
+            rows.append((first, last, pd.Timestamp(day), day.year, day.month))
+    return pd.DataFrame(rows, columns=['off_first_name', 'off_last_name',
+                                       'off_date', 'off_year', 'off_month'])
+
+
+def timed(func, *args):
+    '''
+    Returns the result of func(*args) and the seconds it took
+    '''
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def memory_status(field):
+    '''
+    The kB of field (VmRSS, VmHWM) in /proc/self/status
+    '''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+def reset_peak_rss():
+    '''
+    Resets the kernel's high-water mark of the process' resident memory
+    Returns False where that can't be done (not Linux, or no /proc)
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def release_memory():
+    '''
+    Hands what earlier runs freed back to the OS, so a run that reuses it
+    still shows up in its peak
+    '''
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+# Peak resident memory counts what libxml2 and pyarrow allocate too.
+# Without /proc it falls back to tracemalloc, which sees the Python heap only.
+PEAK_MEMORY = 'rss' if reset_peak_rss() else 'heap'
+
+def measure(func, *args):
+    '''
+    Runs func(*args) twice, once for its time and once for its peak
+    memory: how far it raised the resident set above where it started, or
+    under tracemalloc for the Python heap, which slows it down too much
+    to time it
+    Returns the result, the seconds and the peak bytes
+    '''
+    result, seconds = timed(func, *args)
+    release_memory()
+    if PEAK_MEMORY == 'rss':
+        start = memory_status('VmRSS')
+        reset_peak_rss()
+        func(*args)
+        return result, seconds, max(memory_status('VmHWM') - start, 0) * 1024
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+class Results(object):
+    '''
+    Collects the results of a run, prints each one against the last run
+    of the same benchmark and scale, and appends them all to path
+    '''
+
+    def __init__(self, path=RESULTS_FILE, only=None):
+        self.path = path
+        self.only = only
+        self.rows = []
+        self.previous = {}
+        self.run = {'run':time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'commit':git_commit()}
+        try:
+            with open(path) as f:
+                for line in f:
+                    row = json.loads(line)
+                    self.previous[(row['bench'], row['scale'])] = row
+        except FileNotFoundError:
+            pass
+
+    def wanted(self, *benches):
+        '''
+        True if any of benches is to be run
+        '''
+        return self.only is None or not self.only.isdisjoint(benches)
+
+    def add(self, bench, scale, items, seconds, peak, legacy=None):
+        '''
+        legacy is the seconds the legacy code took on the same input, for
+        the speed-up over it
+        '''
+        if not self.wanted(bench):
+            return
+        row = dict(self.run, bench=bench, scale=scale, items=items,
+                   seconds=round(seconds, 6),
+                   per_second=round(items / seconds, 1) if seconds else None,
+                   peak_mb=round(peak / 2**20, 2), memory=PEAK_MEMORY)
+        if legacy is not None and seconds:
+            row['speedup'] = round(legacy / seconds, 1)
+        self.rows.append(row)
+
+        change = ''
+        last = self.previous.get((bench, scale))
+        if last and last.get('per_second') and row['per_second']:
+            ratio = row['per_second'] / last['per_second'] - 1
+            change = '{:+.0%} vs {}'.format(ratio, last['commit'] or last['run'])
+            if ratio < -TOLERANCE:
+                change += '  REGRESSION'
+        if 'speedup' in row:
+            change = '{}x legacy  {}'.format(row['speedup'], change)
+        print('  {:<24} {:>10,} {:9.3f}s {:12,.0f}/s {:9.1f} MB {:<4}  {}'.format(
+                bench, items, seconds, row['per_second'] or 0,
+                row['peak_mb'], PEAK_MEMORY, change))
+
+    def save(self):
+        with open(self.path, 'a') as f:
+            for row in self.rows:
+                f.write(json.dumps(row) + '\n')
+
+
+def bench_offense(scale, results):
+    '''
+    Times the legacy offense parser against classify_offenses on the same
+    offenses and checks that both give every row the same category
+    '''
+    if not results.wanted('legacy_offense_cat', 'offense_cat'):
+        return True
+    offenses = synthetic_offenses(TABLE_ROWS * 16 * scale)
+    legacy, legacy_seconds, peak = measure(offenses.apply,
+                                           legacy_re_parse_offense)
+    results.add('legacy_offense_cat', scale, len(offenses), legacy_seconds, peak)
+    compiled, seconds, peak = measure(classify_offenses, offenses)
+    results.add('offense_cat', scale, len(offenses), seconds, peak,
+                legacy=legacy_seconds)
+
+    mismatches = (legacy != compiled).sum()
+    if mismatches:
+        print('  {} mismatched offense labels'.format(mismatches))
+        print(pd.DataFrame({'offense':offenses, 'legacy':legacy,
+                            'compiled':compiled})[legacy != compiled].head())
+    return mismatches == 0
+
+def legacy_suspensions(susp):
+    '''
+    The three .apply passes parse_suspensions replaced
+    '''
+    total = susp.apply(legacy_re_parse_total_games)
+    playoff = susp.apply(legacy_re_parse_playoff_games)
+    preseason = susp.apply(legacy_re_parse_preseason_games)
+    return pd.DataFrame({'total_susp_games':total,
+                         'playoff_susp_games':playoff,
+                         'preseason_susp_games':preseason,
+                         'reg_susp_games':total - playoff - preseason})
+
+def bench_suspensions(scale, results):
+    '''
+    Times the three legacy suspension passes against parse_suspensions on
+    the same column and checks that every count matches
+    '''
+    if not results.wanted('legacy_susp_games', 'susp_games'):
+        return True
+    susp = synthetic_suspensions(TABLE_ROWS * 16 * scale)
+    legacy, legacy_seconds, peak = measure(legacy_suspensions, susp)
+    results.add('legacy_susp_games', scale, len(susp), legacy_seconds, peak)
+    one_pass, seconds, peak = measure(parse_suspensions, susp)
+    results.add('susp_games', scale, len(susp), seconds, peak,
+                legacy=legacy_seconds)
+
+    mismatches = (legacy != one_pass[legacy.columns]).any(axis=1).sum()
+    if mismatches:
+        print('  {} mismatched suspension rows'.format(mismatches))
+    return mismatches == 0
+
+def last_row_dropped(page):
+    '''
+    1 if the scraper leaves out the last record of each table on page:
+    the newer tables lose their last row, which is only a totals row
+    when they have one
+    '''
+    susp_headers, fine_headers, totals = LAYOUTS[PAGE_LAYOUTS[page[0:4]]]
+    return int('Date of action' in susp_headers and not totals)
+
+def bench_extraction(scale, results, players):
+    '''
+    Extracts the tables of every season page with lxml, and with bs4 to
+    check both give the same rows
+    Returns the extracted rows, as the cleaner would read them back
+    '''
+    passed = True
+    frames = []
+    totals = {'lxml':[0, 0, 0], 'bs4':[0, 0, 0]}
+    for page, html in season_pages(scale, players):
+        for parser in ('lxml', 'bs4'):
+            if not results.wanted('extract_' + parser):
+                if parser == 'lxml':
+                    # The cleaner benchmarks still need the rows
+                    frames.append(parse_page(page, html, parser))
+                continue
+            frame, seconds, peak = measure(parse_page, page, html, parser)
+            totals[parser][0] += len(frame)
+            totals[parser][1] += seconds
+            totals[parser][2] = max(totals[parser][2], peak)
+            if parser == 'lxml':
+                frames.append(frame)
+            elif not frame.equals(frames[-1]):
+                print('  {}: lxml and bs4 rows differ'.format(page))
+                passed = False
+        expected = 2 * (TABLE_ROWS * scale - last_row_dropped(page))
+        if len(frames[-1]) != expected:
+            print('  {}: {} rows extracted, expected {}'.format(
+                    page, len(frames[-1]), expected))
+            passed = False
+    for parser, (rows, seconds, peak) in totals.items():
+        if rows:
+            results.add('extract_' + parser, scale, rows, seconds, peak)
+    # Saved and read back, so the cleaner gets the dtypes it gets in a run
+    scraped = (os.path.join(SCRATCH_DIR, 'scraped.parquet'),
+               os.path.join(SCRATCH_DIR, 'scraped.csv'))
+    save_frame(pd.concat(frames, ignore_index=True), scraped)
+    return passed, load_frame(scraped)
+
+def parse_offenders(names):
+    '''
+    Parses the offender names with an empty memo, as on a first run
+    '''
+    memo = os.path.join(SCRATCH_DIR, 'name_memo.json')
+    return NameParser(memo).parse_column(names, 'offender')
+
+CLEANER_PASSES = [
+        ('clean_offense_cat', 'offense', classify_offenses),
+        ('clean_victim', 'offense',
+         lambda column: map_unique(column, re_parse_victim)),
+        ('clean_susp_games', 'susp', parse_suspensions),
+        ('clean_forfeit_sal', 'forfeit_sal', parse_money),
+        ('clean_dates', 'off_date', parse_dates),
+        ('clean_names', 'offender', parse_offenders),
+        ]
+
+def money_mismatches(salaries, parsed):
+    '''
+    Counts the rows where parse_money's (amounts, errors) disagree with
+    the legacy money_to_float
+    '''
+    amounts, errors = parsed
+    legacy = salaries.astype(object).map(legacy_money_to_float)
+    legacy_errors = legacy == 'ERROR'
+    legacy_amounts = pd.to_numeric(legacy.where(~legacy_errors))
+    wrong = (errors != legacy_errors) | (~legacy_errors &
+                                         (amounts != legacy_amounts))
+    return wrong.sum()
+
+def bench_cleaner(scale, results, raw):
+    '''
+    Runs each CSV_cleaner pass over the extracted rows, and checks the
+    salaries against the legacy parser
+    '''
+    passed = True
+    for bench, column, func in CLEANER_PASSES:
+        if results.wanted(bench):
+            parsed, seconds, peak = measure(func, raw[column])
+            results.add(bench, scale, len(raw), seconds, peak)
+            if bench == 'clean_forfeit_sal':
+                mismatches = money_mismatches(raw[column], parsed)
+                if mismatches:
+                    print('  {} mismatched salaries'.format(mismatches))
+                    passed = False
+    return passed
+
+def chunk_mismatches(written, whole):
+    '''
+    Describes how the frame the chunked mode wrote differs from clean()
+    on the same rows, or returns None when they are the same
+    '''
+    if not written.index.equals(whole.index):
+        return '{} rows written, clean() keeps {}'.format(len(written),
+                                                          len(whole))
+    written = written[whole.columns].astype(object)
+    whole = whole.astype(object)
+    differ = ~((written == whole) | (written.isna() & whole.isna()))
+    if differ.any().any():
+        return 'values differ in {}'.format(
+                ', '.join(differ.columns[differ.any()]))
+    return None
+
+def bench_clean_chunks(scale, results, raw):
+    '''
+    Cleans the extracted rows in the chunked mode on one process and on
+    every core, to show how close to linear it scales. A tenth of the
+    rows are repeated further down, as when two data sets overlap, and
+    both runs must write what clean() gives for the same rows.
+    '''
+    runs = [(bench, processes) for bench, processes
+            in (('clean_chunks_1', 1), ('clean_chunks_all', os.cpu_count()))
+            if results.wanted(bench)]
+    if not runs:
+        return True
+    source = (os.path.join(SCRATCH_DIR, 'raw.parquet'),
+              os.path.join(SCRATCH_DIR, 'raw.csv'))
+    target = (os.path.join(SCRATCH_DIR, 'clean.parquet'),
+              os.path.join(SCRATCH_DIR, 'clean.csv'))
+    # The repeats go at the end, so they mostly land in other chunks
+    raw = pd.concat([raw, raw.sample(frac=0.1, random_state=scale)],
+                    ignore_index=True)
+    save_frame(raw, source)
+    whole = clean(load_frame(source),
+                  NameParser(os.path.join(SCRATCH_DIR, 'clean_memo.json')),
+                  no_overrides())
+    # Enough chunks to keep every core busy
+    chunksize = min(CHUNK_ROWS, max(1000, len(raw) // (4 * os.cpu_count())))
+
+    passed = True
+    for bench, processes in runs:
+        rows, seconds, peak = measure(clean_chunks, source, target, processes,
+                                      chunksize, no_overrides())
+        results.add(bench, scale, len(raw), seconds, peak)
+        mismatch = chunk_mismatches(load_frame(target), whole)
+        if mismatch:
+            print('  {}: {}'.format(bench, mismatch))
+            passed = False
+    return passed
+
+def directory_ids(first_names, last_names, feeds):
+    '''
+    What nhl_scrape does now: each feed is parsed once into the player
+    directory, and every row is a dictionary lookup
+    '''
+    directory = PlayerDirectory(os.path.join(SCRATCH_DIR,
+                                             'player_directory.json'))
+    for prefix, feed in feeds.items():
+        directory.add_feed(prefix, {'fetched':0,
+                                    'suggestions':json.loads(feed)['suggestions']})
+    return directory.lookup(first_names, last_names)
+
+def bench_player_ids(scale, results, players):
+    '''
+    Matches offender names to NHL IDs through the suggest feeds, with the
+    legacy parse_id scan and the player directory, and checks both agree
+    on the rows the legacy scan gets
+    '''
+    rand = random.Random(scale)
+    feeds = suggest_feeds(players)
+    names = [rand.choice(players)[1:] for _ in range(TABLE_ROWS * 16 * scale)]
+    # A few names that aren't in any feed
+    names[::10] = [('Nobody', 'Known')] * len(names[::10])
+    names = pd.DataFrame(names, columns=['first', 'last'])
+
+    if not results.wanted('player_directory', 'legacy_parse_id'):
+        return True
+    ids, seconds, peak = measure(directory_ids, names['first'],
+                                 names['last'], feeds)
+    results.add('player_directory', scale, len(names), seconds, peak)
+    if not results.wanted('legacy_parse_id'):
+        return True
+    sample = names.head(LEGACY_ID_ROWS)
+    legacy, seconds, peak = measure(legacy_parse_ids, sample['first'],
+                                    sample['last'], feeds)
+    results.add('legacy_parse_id', scale, len(sample), seconds, peak)
+    mismatches = (legacy != ids.head(LEGACY_ID_ROWS)).sum()
+    if mismatches:
+        print('  {} mismatched NHL IDs'.format(mismatches))
+    return mismatches == 0
+
+def parse_gamelogs(htmls):
+    return [gamelog_frame(gamelog_table(html)) for html in htmls]
+
+def bench_gamelogs(scale, results, players):
+    '''
+    Parses synthetic gamelog pages, then matches two offenses a season
+    to the stats of each player before them. The gamelogs are handed to
+    the store up front, so nothing is fetched.
+    '''
+    if not results.wanted('gamelog_frame', 'pre_offense_stats'):
+        return True
+    rand = random.Random(scale)
+    seasons = [rand.choice(players)[1:] + (rand.randint(2010, 2017),)
+               for _ in range(GAMELOGS * scale)]
+    htmls = [gamelog_page(year, rand) for _, _, year in seasons]
+    if results.wanted('gamelog_frame'):
+        games, seconds, peak = measure(parse_gamelogs, htmls)
+        results.add('gamelog_frame', scale, len(htmls) * GAMES, seconds, peak)
+    else:
+        games = parse_gamelogs(htmls)
+    del htmls
+    if not results.wanted('pre_offense_stats'):
+        return True
+
+    store = GamelogStore(directory=SCRATCH_DIR)
+    for (first, last, year), frame in zip(seasons, games):
+        id_ref = last[0:5].lower() + first[0:2].lower() + '01'
+        store.games.setdefault((id_ref, year), frame)
+    dops = offense_rows(seasons)
+    stats, seconds, peak = measure(pre_offense_stats, dops, store)
+    results.add('pre_offense_stats', scale, len(dops), seconds, peak)
+    if stats['age'].isna().any():
+        print('  {} offenses without stats'.format(stats['age'].isna().sum()))
+        return False
+    return True
+
+def run_suite(scale, results):
+    '''
+    Runs every benchmark at one scale
+    Returns False if any parity check failed
+    '''
+    print('scale {}x'.format(scale))
+    players = synthetic_players(PLAYERS * scale)
+    checks = []
+    if results.wanted('extract_lxml', 'extract_bs4', 'clean_chunks_1',
+                      'clean_chunks_all', *[bench for bench, _, _
+                                            in CLEANER_PASSES]):
+        passed, raw = bench_extraction(scale, results, players)
+        checks += [passed,
+                   bench_cleaner(scale, results, raw),
+                   bench_clean_chunks(scale, results, raw)]
+    checks += [bench_offense(scale, results),
+               bench_suspensions(scale, results),
+               bench_player_ids(scale, results, players),
+               bench_gamelogs(scale, results, players)]
+    return all(checks)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    only = None
+    if '--only' in args:
+        at = args.index('--only')
+        only = set(args[at + 1].split(','))
+        del args[at:at + 2]
+    scales = [int(arg) for arg in args] or [10]
+
+    results = Results(only=only)
+    passed = [run_suite(scale, results) for scale in scales]
+    results.save()
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    if not all(passed):
+        sys.exit(1)
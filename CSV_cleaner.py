@@ -1,304 +1,555 @@
-import pandas as pd
-from math import isnan
-import re
-
-dops = pd.read_csv('NHL_Suspensions.csv', encoding='latin1')
-
-'''
-Warning: Regex for victim's name currently will not work with names like
-D'Amigo except for when parsing that last name in the form where the first
-name comes first. Will not do so the other way around and not for offenders.
-'''
-
-# Column 1 = Date of Offense
-# Column 2 = Offender Name
-# Column 3 = Offender's Team
-# Column 4 = Offense
-# Column 5 = Day of DoPs decision
-# Column 6 = Suspension Amount
-# Column 7 = Forfeited Salary
-# Column 8 = Fine
-
-# TODO: Get Contract Info at https://www.capfriendly.com/
-
-
-def re_parse_offense(row):
-    '''
-    This function goes through all the offense descriptions and, based on
-    keywords it's able to parse using Regex, assigns a short description
-    to be coded in later exploration
-    '''
-    re_exps = {r'.*abuse.*official' : 'Abuse of Official',
-               r'Attempt.*' : 'Attempt to Injure',
-               r'Automatic.*' : 'Automatic Suspension',
-               r'Blindsid.*' : 'Blindsiding',
-               r'Board.*' : 'Boarding',
-               r'[Bb]utt-?end.*' : 'Butt-Ending',
-               r'[Cc]harg.*' : 'Charging',
-               r'Clip.*' : 'Clipping',
-               r'([Cc]omment.*|[Cc]omplaint.*|[Gg]esture.*|[Ss]lur)' : 'Comments/Gestures',
-               r'Cross.check.*' : 'Cross-checking',
-               r'Diving.*' : 'Diving',
-               r'Elbow.*': 'Elbowing',
-               r'[Hh]ead-?butt.*' : 'Head-Butting',
-               r'High.stick.*' : 'High-Stick',
-               r'(Hit.*|Check.*) from behind':'Hitting from Behind',
-               r'Illegal( check| hit)' : 'Illegal Check',
-               r'(Inappropriate.*|conduct)' : 'Inappropriate Conduct',
-               r'([Ii]nstigat.*|[Aa]ggress.*)' : 'Instigator',  
-               r'Interfer.*' : 'Interference',
-               r'Knee-on-knee.*' : 'Knee-on-knee',
-               r'([Kk]ick.*|Kneeing)' : 'Kicking or Kneeing',
-               r'([Ll]ate|[Ll]ow)?.*([Hh]it.|[Cc]heck)(to the head)?' : 'Illegal hit',# Late, low, to head
-               r'[Ll]eaving.*bench' : 'Leaving Bench',
-               r'[Pp]unch.*' : 'Punching',                            
-               r'Roughing.*' : 'Roughing',
-               r'Slash.*' : 'Slashing', 
-               r'[Ss]lew.*' : 'Slew-footing',
-               r'Spear.*': 'Spearing',
-               r'[Tt]rip.*' : 'Tripping',
-               r'.*[Vv]iolating' : 'Drugs',
-               }
-    for k,v in re_exps.items():
-        if re.search(k, row):
-            return v
-        else:
-            continue
-    return 'NO PARSE' # Labels uncoded entries
-        
-
-def re_parse_victim(row):
-    '''
-    This function parses player names out of the description of the offenses
-    '''
-    
-    errors = ['Substances Program','Health Program',
-              'Star Game','Montreal Canadiens',
-              'Vancouver Canucks','Maple Leafs','Red Wings',]
-    
-    vic = re.compile(r'''
-                     (?:[A-Z]\w+ing)?
-                     .*
-                     (([A-Z]\w+\s[A-Z]\w+| # Regular names
-                     [A-Z][.]\s?[A-Z][.]\s?\s[A-Z]\w+| # P. K.s and T.J.s
-                     [A-Z]\w+\s[A-Z]'[A-Z]\w+ # D'Amigos
-                     ))
-                     ''', re.VERBOSE)
-    try:
-        if vic.search(row).group(1) in errors:
-            return "No Player Victim"
-        else:
-            return vic.search(row).group(1)
-    except AttributeError: 
-        return "No Player Victim"
-    
-       
-def re_parse_total_games(row):
-    '''
-    This finds the total number of games a player was suspended for.
-    The regex assumes that the first number is the number of games suspended
-    which is true for 99% of entries*
-    
-    (*Tortorella was suspended 15 days, which amounted to 6 games)
-    '''
-    
-    games = re.compile(r'''
-                       (\d+)
-                       (?:\s.*)?
-                       ''', re.VERBOSE)
-    return int(re.search(games, row).group(1))
-
-def re_parse_playoff_games(row):
-    '''
-    Uses regex to find the number of playoff games in the suspension
-    '''
-    
-    post_games = re.compile(r'''
-                          .*?
-                          (\d+)
-                          (?:\s[A-Z]{,3})?
-                          (?:\s\d{4})?
-                          \s
-                          post-season.*                          
-                          ''', re.VERBOSE)
-    try:
-        return int(re.search(post_games, row).group(1))
-    except AttributeError:
-        return 0
-    
-def re_parse_preseason_games(row):
-    '''
-    Uses regex to get the number of preseason games in the suspension
-    '''
-    
-    pre_games = re.compile(r'''
-                          .*?
-                          (\d+)
-                          (?:\s[A-Z]{,3})?
-                          (?:\s\d{4})?
-                          \s
-                          pre-season.*                          
-                          ''', re.VERBOSE)
-    try:
-        return int(re.search(pre_games, row).group(1))
-    except AttributeError:
-        return 0
-
-def money_to_float(row):
-    replacements = {"$":'', ",":""}
-    if type(row) is str:
-        try:
-            return float(''.join([replacements.get(c,c) for c in row]))
-        except ValueError:
-            try:
-                re_expr = re.compile(r'''
-                          [$]
-                          (\d+,\d+.\d+)
-                          .*?                          
-                          ''', re.VERBOSE)
-                money = re.search(re_expr, row).group(1)
-                return float(''.join([replacements.get(c,c) for c in money]))
-            except AttributeError:
-                return "ERROR"
-    else:
-        return 0
-    
-def get_year(row):
-    '''
-    This function pulls the year out of datetime object and returns
-    just the year
-    '''
-    try:
-        return int(row.year)
-    except ValueError:
-        return 0
-
-def get_month(row):
-    '''
-    This function pulls the year out of datetime object and returns
-    just the month
-    '''
-    try:
-        return int(row.month)
-    except ValueError:
-        return 0
-
-def get_day(row):
-    '''
-    This function pulls the year out of datetime object and returns
-    just the day
-    '''
-    try:
-        return int(row.day)
-    except ValueError:
-        return 0
-    
-def get_off_lastname(name):
-    '''Parse the victim's last name'''
-    non_player = ['No Player Victim', 'Team', 'Organization']
-    if name in non_player:
-        return None
-    
-    if ',' in name:
-        reg_exp =  re.compile(r'(\w+)[,]?\s\w+')
-        return reg_exp.findall(name).pop()
-    
-    else:
-        reg_exp =  re.compile(r'.*\s(\w+)')
-        return reg_exp.findall(name).pop()
-
-def get_off_firstname(name):
-    '''Parse the victim's last name'''
-    non_player = ['No Player Victim', 'Team', 'Organization']
-    if name in non_player:
-        return None
-    
-    if ',' in name:
-        reg_exp =  re.compile(r'\w+[,]?\s(\w+)')
-        return reg_exp.findall(name).pop()
-    
-    else:
-        reg_exp =  re.compile(r'(.*)\s\w+')
-        return reg_exp.findall(name).pop()
-
-def get_vic_lastname(name):
-    '''Parse the victim's last name'''
-    non_player = ['No Player Victim', 'Team', 'Organization']
-    if name in non_player:
-        return None
-    
-    if ',' in name:
-        reg_exp =  re.compile(r'(\w+)[,]?\s\w+')
-        return reg_exp.findall(name).pop()
-    
-    else:
-        reg_exp =  re.compile(r'.*\s([A-Z].\w+|\w+)')
-        return reg_exp.findall(name).pop()
-
-def get_vic_firstname(name):
-    non_player = ['No Player Victim', 'Team', 'Organization']
-    if name in non_player:
-        return None
-    
-    if ',' in name:
-        reg_exp =  re.compile(r'\w+[,]?\s(\w+)')
-        return reg_exp.findall(name).pop()
-    
-    else:
-        reg_exp =  re.compile(r'(.*)\s\w+')
-        return reg_exp.findall(name).pop()
-
-# Apply functions to create new columns
-dops['offense_cat'] = dops['offense'].apply(re_parse_offense)
-dops['victim'] = dops['offense'].apply(re_parse_victim)
-dops['total_susp_games'] = dops['susp'].apply(re_parse_total_games)
-dops['playoff_susp_games'] = dops['susp'].apply(re_parse_playoff_games)
-dops['preseason_susp_games'] = dops['susp'].apply(re_parse_preseason_games)
-dops['reg_susp_games'] = (dops['total_susp_games'] - dops['playoff_susp_games']
-                         - dops['preseason_susp_games'])
-dops['forfeit_sal'] = dops['forfeit_sal'].apply(money_to_float)
-
-# Turn dates into datetime, extract year, month, date
-dops['off_date'] = pd.to_datetime(dops['off_date'], 
-    infer_datetime_format=True)
-dops['off_year'] = dops['off_date'].apply(get_year)
-dops['off_month'] = dops['off_date'].apply(get_month)
-dops['off_day'] = dops['off_date'].apply(get_day)
-
-# Same as above but for the dops date
-dops['dops_date'] = pd.to_datetime(dops['dops_date'], 
-    infer_datetime_format=True)
-dops['dops_year'] = dops['dops_date'].apply(get_year)
-dops['dops_month'] = dops['dops_date'].apply(get_month)
-dops['dops_day'] = dops['dops_date'].apply(get_day)
-
-dops['off_last_name'] = dops['offender'].apply(get_off_lastname)
-dops['off_first_name'] = dops['offender'].apply(get_off_firstname)
-dops['vic_last_name'] = dops['victim'].apply(get_vic_lastname)
-dops['vic_first_name'] = dops['victim'].apply(get_vic_firstname)
-
-# Manually set some unique cases
-dops.set_value(21, 'offense_cat', 'Spearing')
-dops.set_value(139,'offense_cat', 'Instigating')
-dops.set_value(147, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(198, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(205, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(248, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(338, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(339, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(352, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(381, 'offense_cat', 'Illegal Hit')
-dops.set_value(388, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(390, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(394, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(401, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(431, 'offense_cat', 'Inappropriate Conduct')
-dops.set_value(182, 'total_susp_games', 6)
-dops.set_value(241, 'total_susp_games', 6)
-dops.set_value(381, 'total_susp_games', 4)
-dops.set_value(94, 'forfeit_sal', 0)
-
-dops.drop(dops.index[1], inplace=True) # Suspension included in two data sets
-
-
-dops.to_csv('Scrubbed_CSV.csv')
+import numpy as np
+import pandas as pd
+from math import isnan
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from Instrumentation import timed, timer, info
+from Name_Parser import NameParser
+from Storage import (SUSPENSIONS, SCRUBBED, save_frame, load_frame,
+                     iter_frames, FrameWriter)
+
+'''
+Warning: Regex for victim's name currently will not work with names like
+D'Amigo except for when parsing that last name in the form where the first
+name comes first. Will not do so the other way around and not for offenders.
+'''
+
+# Column 1 = Date of Offense
+# Column 2 = Offender Name
+# Column 3 = Offender's Team
+# Column 4 = Offense
+# Column 5 = Day of DoPs decision
+# Column 6 = Suspension Amount
+# Column 7 = Forfeited Salary
+# Column 8 = Fine
+
+# TODO: Get Contract Info at https://www.capfriendly.com/
+
+
+# Offense categories in priority order: the first pattern found anywhere in
+# the description decides the category.
+OFFENSE_PATTERNS = (
+        (r'.*abuse.*official', 'Abuse of Official'),
+        (r'Attempt.*', 'Attempt to Injure'),
+        (r'Automatic.*', 'Automatic Suspension'),
+        (r'Blindsid.*', 'Blindsiding'),
+        (r'Board.*', 'Boarding'),
+        (r'[Bb]utt-?end.*', 'Butt-Ending'),
+        (r'[Cc]harg.*', 'Charging'),
+        (r'Clip.*', 'Clipping'),
+        (r'(?:[Cc]omment.*|[Cc]omplaint.*|[Gg]esture.*|[Ss]lur)', 'Comments/Gestures'),
+        (r'Cross.check.*', 'Cross-checking'),
+        (r'Diving.*', 'Diving'),
+        (r'Elbow.*', 'Elbowing'),
+        (r'[Hh]ead-?butt.*', 'Head-Butting'),
+        (r'High.stick.*', 'High-Stick'),
+        (r'(?:Hit.*|Check.*) from behind', 'Hitting from Behind'),
+        (r'Illegal(?: check| hit)', 'Illegal Check'),
+        (r'(?:Inappropriate.*|conduct)', 'Inappropriate Conduct'),
+        (r'(?:[Ii]nstigat.*|[Aa]ggress.*)', 'Instigator'),
+        (r'Interfer.*', 'Interference'),
+        (r'Knee-on-knee.*', 'Knee-on-knee'),
+        (r'(?:[Kk]ick.*|Kneeing)', 'Kicking or Kneeing'),
+        (r'(?:[Ll]ate|[Ll]ow)?.*(?:[Hh]it.|[Cc]heck)(?:to the head)?', 'Illegal hit'),# Late, low, to head
+        (r'[Ll]eaving.*bench', 'Leaving Bench'),
+        (r'[Pp]unch.*', 'Punching'),
+        (r'Roughing.*', 'Roughing'),
+        (r'Slash.*', 'Slashing'),
+        (r'[Ss]lew.*', 'Slew-footing'),
+        (r'Spear.*', 'Spearing'),
+        (r'[Tt]rip.*', 'Tripping'),
+        (r'.*[Vv]iolating', 'Drugs'),
+        )
+
+# Compiled once. Tried one by one, a description only goes as far as the
+# first pattern it matches; one alternation of them all is slower than
+# that, as every branch scans the whole description.
+OFFENSE_RES = [(re.compile(pattern), label)
+               for pattern, label in OFFENSE_PATTERNS]
+
+
+def classify_offense(offense):
+    '''
+    Returns the category of the first pattern found in the description
+    '''
+    for pattern, label in OFFENSE_RES:
+        if pattern.search(offense):
+            return label
+    return 'NO PARSE' # Labels uncoded entries
+
+@timed('clean.offense_cat', rows=len)
+def classify_offenses(offenses):
+    '''
+    This function goes through all the offense descriptions and, based on
+    keywords it's able to parse using Regex, assigns a short description
+    to be coded in later exploration.
+    Input the offense column, returns the matching column of categories.
+    Each distinct description is only classified once.
+    '''
+    return map_unique(offenses, classify_offense).fillna('NO PARSE')
+        
+
+VICTIM_RE = re.compile(r'''
+                     (?:[A-Z]\w+ing)?
+                     .*
+                     (([A-Z]\w+\s[A-Z]\w+| # Regular names
+                     [A-Z][.]\s?[A-Z][.]\s?\s[A-Z]\w+| # P. K.s and T.J.s
+                     [A-Z]\w+\s[A-Z]'[A-Z]\w+ # D'Amigos
+                     ))
+                     ''', re.VERBOSE)
+
+NOT_VICTIMS = ['Substances Program','Health Program',
+               'Star Game','Montreal Canadiens',
+               'Vancouver Canucks','Maple Leafs','Red Wings',]
+
+def re_parse_victim(row):
+    '''
+    This function parses player names out of the description of the offenses
+    '''
+    found = VICTIM_RE.search(row)
+    if found is None or found.group(1) in NOT_VICTIMS:
+        return "No Player Victim"
+    return found.group(1)
+
+@timed('clean.map_unique', rows=len)
+def map_unique(column, func):
+    '''
+    Runs func once per distinct value of the column and maps the results
+    back onto every row
+    '''
+    results = {value:func(value) for value in column.dropna().unique()}
+    return column.map(results)
+    
+       
+# One match per number in the suspension length. A number followed by an
+# optional qualifier and 'pre-season'/'post-season' counts those games,
+# e.g. '1 NHL 2014 post-season'. A number followed by 'days' or 'games'
+# records its unit.
+SUSP_TOKEN_RE = re.compile(r'''
+        (?P<n>\d+)
+        (?:(?:\s[A-Z]{,3})?(?:\s\d{4})?\s(?P<kind>pre|post)-season
+        |\s(?P<unit>days?|games?)\b)?
+        ''', re.VERBOSE)
+
+# Regular season games per day of the schedule (82 games over ~186 days),
+# used for suspensions given in days that don't say how many games they were
+GAMES_PER_DAY = 82 / 186
+
+
+@timed('clean.susp_games', rows=len)
+def parse_suspensions(susp):
+    '''
+    Reads the suspension length column in one pass and returns a DataFrame
+    with the total, playoff, preseason and regular season games.
+    
+    The first number is the total number of games, except for suspensions
+    given in days (Tortorella was suspended 15 days, which amounted to
+    6 games): those use the games count given with them, or an estimate
+    from the length in days when there is none.
+    '''
+    tokens = susp.astype(str).str.extractall(SUSP_TOKEN_RE)
+    # With no number anywhere (a table of fines, say) nothing is counted
+    total = playoff = preseason = pd.Series(dtype='int64')
+    if not tokens.empty:
+        tokens['n'] = tokens['n'].astype('int64')
+        unit = tokens['unit'].fillna('')
+        
+        first = tokens.xs(0, level='match')
+        total = first['n']
+        in_days = unit.xs(0, level='match').str.startswith('day')
+        games = tokens.loc[unit.str.startswith('game'), 'n'].groupby(level=0).first()
+        day_games = games.reindex(total.index).fillna(total * GAMES_PER_DAY // 1)
+        total = total.where(~in_days, day_games)
+        
+        playoff = tokens.loc[tokens['kind'] == 'post', 'n'].groupby(level=0).first()
+        preseason = tokens.loc[tokens['kind'] == 'pre', 'n'].groupby(level=0).first()
+    
+    games = pd.DataFrame(index=susp.index)
+    games['total_susp_games'] = total.reindex(susp.index).astype('Int16')
+    games['playoff_susp_games'] = playoff.reindex(susp.index,
+                                                  fill_value=0).astype('int16')
+    games['preseason_susp_games'] = preseason.reindex(susp.index,
+                                                     fill_value=0).astype('int16')
+    games['reg_susp_games'] = (games['total_susp_games']
+                               - games['playoff_susp_games']
+                               - games['preseason_susp_games'])
+    return games
+
+# A dollar amount inside a longer piece of text
+EMBEDDED_MONEY = r'[$](\d+,\d+.\d+)'
+
+# Manual corrections, keyed by record
+OVERRIDES_FILE = 'DoPS_Overrides.csv'
+
+# Rows with the same record and suspension length are one suspension
+DEDUPE_COLUMNS = ['record_key', 'total_susp_games']
+
+# The corrections as they were first made, by row of NHL_Suspensions.csv.
+# migrate_legacy_overrides turns them into OVERRIDES_FILE, once, with
+# python CSV_cleaner.py --migrate-overrides
+LEGACY_OVERRIDES = [
+        (21, 'offense_cat', 'Spearing'),
+        (139, 'offense_cat', 'Instigating'),
+        (147, 'offense_cat', 'Inappropriate Conduct'),
+        (198, 'offense_cat', 'Inappropriate Conduct'),
+        (205, 'offense_cat', 'Inappropriate Conduct'),
+        (248, 'offense_cat', 'Inappropriate Conduct'),
+        (338, 'offense_cat', 'Inappropriate Conduct'),
+        (339, 'offense_cat', 'Inappropriate Conduct'),
+        (352, 'offense_cat', 'Inappropriate Conduct'),
+        (381, 'offense_cat', 'Illegal Hit'),
+        (388, 'offense_cat', 'Inappropriate Conduct'),
+        (390, 'offense_cat', 'Inappropriate Conduct'),
+        (394, 'offense_cat', 'Inappropriate Conduct'),
+        (401, 'offense_cat', 'Inappropriate Conduct'),
+        (431, 'offense_cat', 'Inappropriate Conduct'),
+        (182, 'total_susp_games', 6),
+        (241, 'total_susp_games', 6),
+        (381, 'total_susp_games', 4),
+        (94, 'forfeit_sal', 0),
+        (1, '_drop', 'repeats'), # Suspension included in two data sets
+        ]
+
+# The date formats used on the season pages, tried in this order
+DATE_FORMATS = ('%B %d, %Y', '%Y-%m-%d', '%d %B %Y', '%b %d, %Y')
+
+
+@timed('clean.money', rows=lambda parsed: len(parsed[0]))
+def parse_money(column):
+    '''
+    Turns a column of dollar amounts into floats.
+    Returns the amounts and a mask of the rows that could not be read.
+    Rows that aren't text (no salary forfeited) count as 0.
+    '''
+    # Text can come as object or as pandas' str dtype, so only a column of
+    # numbers (no text in it at all) is skipped
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return (pd.Series(0.0, index=column.index),
+                pd.Series(False, index=column.index))
+    
+    is_text = column.str.len().notna()
+    amount = pd.to_numeric(column.str.replace(r'[$,]', '', regex=True)
+                           .str.strip(), errors='coerce')
+    embedded = pd.to_numeric(column.str.extract(EMBEDDED_MONEY, expand=False)
+                             .str.replace(',', '', regex=False),
+                             errors='coerce')
+    amount = amount.fillna(embedded).astype('float64')
+    error = is_text & amount.isna()
+    return amount.where(is_text, 0.0), error
+
+@timed('clean.dates', rows=len)
+def parse_dates(column):
+    '''
+    Parses a column of dates by trying each known format on the whole
+    column in turn. Anything no format matched is left to pandas to guess.
+    '''
+    dates = pd.Series(pd.NaT, index=column.index, dtype='datetime64[ns]')
+    for fmt in DATE_FORMATS:
+        todo = dates.isna() & column.notna()
+        if not todo.any():
+            return dates
+        dates[todo] = pd.to_datetime(column[todo], format=fmt, errors='coerce')
+    
+    todo = dates.isna() & column.notna()
+    if todo.any():
+        dates[todo] = pd.to_datetime(column[todo], errors='coerce')
+    return dates
+
+def date_parts(dates, prefix):
+    '''
+    Splits a datetime column into nullable year, month and day columns
+    '''
+    return pd.DataFrame({prefix + '_year':dates.dt.year.astype('Int16'),
+                         prefix + '_month':dates.dt.month.astype('Int8'),
+                         prefix + '_day':dates.dt.day.astype('Int8')})
+    
+def record_keys(dops, canonical_offender):
+    '''
+    Returns a stable key for every row, hashed from the offender's
+    canonical name and the offense and DoPS dates. Unlike row numbers it
+    doesn't change when a re-scrape moves rows around.
+    '''
+    key = pd.DataFrame({
+            'offender':canonical_offender.fillna(dops['offender']).astype(str)
+                       .str.strip().str.lower(),
+            'off_date':dops['off_date'].dt.strftime('%Y-%m-%d'),
+            'dops_date':dops['dops_date'].dt.strftime('%Y-%m-%d')})
+    return pd.util.hash_pandas_object(key, index=False).astype(str)
+
+def no_overrides():
+    return pd.DataFrame({'record_key':[], 'column':[], 'value':[]}, dtype=str)
+
+def load_overrides(path=OVERRIDES_FILE):
+    '''
+    Reads the manual corrections: one row per record_key, column and
+    value. A column of '_drop' removes the record, or with a value of
+    'repeats' only the rows that repeat it. Without the file there are no
+    corrections.
+    '''
+    try:
+        return pd.read_csv(path, dtype={'record_key':str, 'value':str})
+    except FileNotFoundError:
+        info('No %s, cleaning without corrections', path)
+        return no_overrides()
+
+def is_suspension(record):
+    # Fines tables have no suspension column and get 0 games
+    return str(record['susp']).strip() not in ('0', '')
+
+def legacy_mismatch(dops, position, column):
+    '''
+    Returns why the legacy correction for row position can't be meant for
+    that row of dops, or None if it fits
+    '''
+    if not 0 <= position < len(dops):
+        return 'row {} is past the end of the table ({} rows)'.format(
+                position, len(dops))
+    record = dops.iloc[position]
+    found = 'row {} ({}, {})'.format(position, record['offender'],
+                                     record['off_date'])
+    if column == '_drop':
+        # It was dropped as a suspension included in two data sets
+        if (dops['record_key'] == record['record_key']).sum() < 2:
+            return found + ' is not listed twice'
+    elif column in ('total_susp_games', 'forfeit_sal'):
+        if not is_suspension(record):
+            return found + ' is a fine, not a suspension'
+    return None
+
+def migrate_legacy_overrides(dops):
+    '''
+    Input the table cleaned without corrections or dedupe, so its rows
+    are those of NHL_Suspensions.csv
+    Turns the old row-number corrections into keyed overrides. The row
+    numbers are only right for the scrape they were written for, so each
+    row is checked against its correction first, and nothing is migrated
+    if any of them doesn't fit.
+    '''
+    problems = []
+    rows = []
+    for position, column, value in LEGACY_OVERRIDES:
+        problem = legacy_mismatch(dops, position, column)
+        if problem is not None:
+            problems.append('{} = {!r}: {}'.format(column, value, problem))
+            continue
+        record = dops.iloc[position]
+        rows.append({'record_key':record['record_key'], 'column':column,
+                     'value':str(value), 'offender':record['offender'],
+                     'off_date':record['off_date']})
+    if problems:
+        raise ValueError('The legacy corrections don\'t fit this table:\n  '
+                         + '\n  '.join(problems))
+    return pd.DataFrame(rows, columns=['record_key', 'column', 'value',
+                                       'offender', 'off_date'])
+
+def migrate_overrides(source=SUSPENSIONS, path=OVERRIDES_FILE):
+    '''
+    Writes OVERRIDES_FILE from LEGACY_OVERRIDES. Refuses to overwrite it.
+    '''
+    if os.path.exists(path):
+        raise ValueError('{} already exists'.format(path))
+    dops = clean(load_frame(source), overrides=no_overrides(),
+                 dedupe=False)
+    overrides = migrate_legacy_overrides(dops)
+    overrides.to_csv(path, index=False)
+    info('%d corrections written to %s, check them against the table',
+         len(overrides), path)
+    return overrides
+
+@timed('clean.overrides', rows=len)
+def apply_overrides(dops, overrides):
+    '''
+    Applies every correction with one merge on record_key
+    '''
+    if overrides.empty:
+        return dops
+    fixes = (overrides.drop_duplicates(['record_key', 'column'], keep='last')
+             .pivot(index='record_key', columns='column', values='value'))
+    fixes = dops[['record_key']].merge(fixes, how='left', left_on='record_key',
+                                       right_index=True)
+    fixes.index = dops.index
+    
+    for column in fixes.columns.drop(['record_key', '_drop'], errors='ignore'):
+        values = fixes[column]
+        fixed = values.notna()
+        if not fixed.any():
+            continue
+        if pd.api.types.is_numeric_dtype(dops[column]):
+            values = pd.to_numeric(values).astype(dops[column].dtype)
+        dops[column] = values.where(fixed, dops[column])
+        if column + '_error' in dops:
+            dops.loc[fixed, column + '_error'] = False
+    
+    if '_drop' in fixes:
+        drop = fixes['_drop'].notna()
+        drop &= (fixes['_drop'] != 'repeats') | dops['record_key'].duplicated()
+        dops = dops[~drop]
+    return dops
+
+@timed('clean', rows=len)
+def clean(dops, names=None, overrides=None, dedupe=True):
+    '''
+    Input the scraped suspension table
+    Returns it with the parsed and corrected columns added
+    
+    names (a NameParser) and overrides are made or loaded when not given.
+    A NameParser that is passed in isn't saved. The row-number corrections
+    of LEGACY_OVERRIDES are never applied here: migrate them to
+    OVERRIDES_FILE first. With dedupe=False rows
+    that repeat a record are kept.
+    '''
+    # Apply functions to create new columns
+    dops['offense_cat'] = classify_offenses(dops['offense'])
+    dops['victim'] = map_unique(dops['offense'], re_parse_victim)
+    games = parse_suspensions(dops['susp'])
+    dops[games.columns] = games
+    dops['forfeit_sal'], dops['forfeit_sal_error'] = parse_money(
+            dops['forfeit_sal'])
+
+    # Turn dates into datetime, extract year, month, date
+    for prefix in ('off', 'dops'):
+        dates = parse_dates(dops[prefix + '_date'])
+        dops[prefix + '_date'] = dates
+        parts = date_parts(dates, prefix)
+        dops[parts.columns] = parts
+
+    # Each distinct name is only parsed once, and only once across runs
+    save_names = names is None
+    if save_names:
+        names = NameParser()
+    offenders = names.parse_column(dops['offender'], 'offender')
+    dops['off_last_name'] = offenders['last']
+    dops['off_first_name'] = offenders['first']
+    victims = names.parse_column(dops['victim'], 'victim')
+    dops['vic_last_name'] = victims['last']
+    dops['vic_first_name'] = victims['first']
+    if save_names:
+        names.save()
+
+    # Manually set some unique cases, and drop suspensions that were
+    # included in two data sets
+    dops['record_key'] = record_keys(dops, offenders['canonical'])
+    if overrides is None:
+        overrides = load_overrides()
+    dops = apply_overrides(dops, overrides)
+    if dedupe:
+        dops = dops[~dops.duplicated(DEDUPE_COLUMNS)]
+    return dops
+
+
+# Rows read at a time in the chunked mode
+CHUNK_ROWS = 50000
+
+# What each worker process of the chunked mode cleans with
+worker = {}
+
+def start_worker(overrides):
+    worker['names'] = NameParser()
+    worker['overrides'] = overrides
+
+def clean_chunk(chunk):
+    '''
+    Cleans one chunk in a worker process. Duplicates are left in, as the
+    record they repeat may be in another chunk.
+    Returns the cleaned chunk and the hash of each row's DEDUPE_COLUMNS
+    '''
+    chunk = clean(chunk, worker['names'], worker['overrides'], dedupe=False)
+    keys = pd.util.hash_pandas_object(chunk[DEDUPE_COLUMNS], index=False)
+    return chunk, keys.to_numpy(np.uint64)
+
+def ordered_results(pool, func, items, window):
+    '''
+    Like pool.map, but only reads window items ahead of the result it
+    is waiting for, so the items don't all have to fit in memory
+    '''
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+class SeenKeys(object):
+    '''
+    The row hashes the chunked mode has written, 8 bytes a row. They are
+    kept in a few sorted arrays, each over twice the size of the next one,
+    so a chunk is checked against them with a binary search of each and
+    adding one only re-sorts the small arrays.
+    '''
+    def __init__(self):
+        self.runs = []
+
+    def found(self, keys):
+        '''
+        Returns a mask of the keys already seen
+        '''
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            at = np.searchsorted(run, keys).clip(max=len(run) - 1)
+            found |= run[at] == keys
+        return found
+
+    def first_seen(self, keys):
+        '''
+        Returns a mask of the keys not seen before or earlier in keys, and
+        adds them all
+        '''
+        keep = ~pd.Series(keys).duplicated().to_numpy()
+        keep[keep] = ~self.found(keys[keep])
+        run = np.sort(keys[keep])
+        while self.runs and len(self.runs[-1]) <= 2 * len(run):
+            run = np.sort(np.concatenate([self.runs.pop(), run]))
+        if len(run):
+            self.runs.append(run)
+        return keep
+
+def clean_chunks(source=SUSPENSIONS, target=SCRUBBED, processes=None,
+                 chunksize=CHUNK_ROWS, overrides=None, csv=False,
+                 mp_context=None):
+    '''
+    Cleans a table too big to clean in one go. It is read chunksize rows
+    at a time and the chunks are cleaned on a pool of processes. Cleaned
+    chunks are written out in order as they come back, without the rows
+    whose record was already written, so only a few chunks are ever in
+    memory. The workers hash the rows, and only the hashes are kept
+    here (see SeenKeys). mp_context is how the processes are started (see
+    ProcessPoolExecutor).
+    Returns the number of rows written.
+    '''
+    if overrides is None:
+        overrides = load_overrides()
+    
+    processes = processes or os.cpu_count()
+    seen = SeenKeys()
+    written = 0
+    with timer('clean.chunks') as span, \
+            ProcessPoolExecutor(processes, mp_context=mp_context,
+                                initializer=start_worker,
+                                initargs=(overrides,)) as pool, \
+            FrameWriter(target, csv) as writer:
+        for chunk, keys in ordered_results(pool, clean_chunk,
+                                           iter_frames(source, chunksize),
+                                           2 * processes):
+            chunk = chunk[seen.first_seen(keys)]
+            writer.write(chunk)
+            written += len(chunk)
+        span.rows = written
+    return written
+
+
+if __name__ == '__main__':
+    if '--migrate-overrides' in sys.argv:
+        try:
+            migrate_overrides()
+        except ValueError as error:
+            sys.exit(str(error))
+    elif '--chunked' in sys.argv:
+        clean_chunks(csv='--csv' in sys.argv)
+    else:
+        dops = clean(load_frame(SUSPENSIONS))
+        save_frame(dops, SCRUBBED, '--csv' in sys.argv)
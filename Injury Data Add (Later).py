@@ -1,76 +1,119 @@
-'''
-Injury Data from http://nhlinjuryviz.blogspot.ca/p/index-page.html
-'''
-
-import pandas as pd
-import re
-
-# TODO: Get victim's team
-
-inj = pd.read_csv('NHL_Injuries.csv')
-
-# TODO: Change this CSV to the new stats one
-dops = pd.read_csv('Scrubbed_CSV.csv', encoding='latin1')
-
-def reformat_season_year(row):
-    '''
-    Uses regex to parse the starting year of the season
-    '''
-    
-    year = re.compile(r'''
-                          ([2][0]\d{2})
-                                                   
-                          ''', re.VERBOSE)
-    return int(re.search(year, row).group(1))
-
-inj['start_year'] = inj['Season'].apply(reformat_season_year)
-
-# Eliminate the injuries that are not caused by things players get 
-# suspended for.
-elim_injs = ['Pneumonia', 'Thyroid', 'Migraine', 'Blood clots',
-             'Sinus', 'Stomach', 'Bronchitis', 'Vertigo', 'Heart',
-             'Dizziness', 'Appendectomy', 'Fatigue', 'Illness', 'Flu']
-inj = inj[-inj['Injury Type'].isin(elim_injs)]
-
-victim_names = dops['victim'].unique()
-#victim_names = victim_names[victim_names != 'No Player Victim']
-
-vic_set = set(dops['vic_last_name'])
-inj_set = set(inj['Player'])
-
-intersect = inj_set.intersection(vic_set)
-#intersect = set(['Zucker'])
-
-# See how many injuries and suspension year match up
-inj_connect = pd.DataFrame(columns=['victim', 'date', 'games_missed',
-                                         'inj_type', 'susp_act'])
-
-# TODO: Multiple injuries in a year should appear as separate lines
-# TODO: Maybe get victim's team first
-# USE df[(df['x'] == 'a') & (df['y'] == 'b')]!!!
-for player in intersect:
-    dops_df = dops[dops['vic_last_name'] == player]
-    inj_df = inj[inj['Player'] == player]
-     
-    new_year_months = [1,2,3,4,5,6,7]
-    for index, row in dops_df.iterrows():
-        off_year = row['off_year']
-        if row['off_month'] in new_year_months:
-            off_year -= 1   
-        
-        if off_year in inj_df['start_year'].values:
-            inj_year = inj_df[inj_df['start_year'] == off_year]
-            #print(inj_year)
-            victim = row['vic_last_name']
-            date = row['off_date']
-            print(date)
-            g_miss = inj_year['Games Missed']
-            print(g_miss)
-            inj_type = inj_year['Injury Type']
-            susp_act = row['offense_cat']
-                
-        inj_connect.loc[len(inj_susp_connect)] = [victim, date,
-                             g_miss, inj_type, susp_act]
-    break        
-        
-print(len(inj_susp_connect))
+'''
+Injury Data from http://nhlinjuryviz.blogspot.ca/p/index-page.html
+'''
+
+import sys
+import pandas as pd
+
+from Instrumentation import timed, info
+from Name_Index import NameIndex, LINK_SCORE
+from Storage import SCRUBBED, INJURY_MATCHES, save_frame, load_frame
+
+# TODO: Get victim's team
+
+# Offenses in these months belong to the season that started the year before
+NEW_YEAR_MONTHS = [1,2,3,4,5,6,7]
+
+# Eliminate the injuries that are not caused by things players get 
+# suspended for.
+ELIM_INJS = ['Pneumonia', 'Thyroid', 'Migraine', 'Blood clots',
+             'Sinus', 'Stomach', 'Bronchitis', 'Vertigo', 'Heart',
+             'Dizziness', 'Appendectomy', 'Fatigue', 'Illness', 'Flu']
+
+
+def season_start_years(seasons):
+    '''
+    Parses the starting year out of a column of season names
+    '''
+    return seasons.str.extract(r'([2][0]\d{2})', expand=False).astype(int)
+
+def load_injuries(path='NHL_Injuries.csv'):
+    inj = pd.read_csv(path)
+    inj['start_year'] = season_start_years(inj['Season'])
+    return inj[~inj['Injury Type'].isin(ELIM_INJS)]
+
+def offense_start_years(dops):
+    '''
+    Returns the year the season of each offense started in
+    '''
+    return dops['off_year'] - dops['off_month'].isin(NEW_YEAR_MONTHS).astype(int)
+
+def link_victims(dops, inj, min_score=LINK_SCORE):
+    '''
+    Finds the injured player each suspension victim most likely is, for
+    names that are spelt differently in the two data sets. Each distinct
+    (victim, season) is looked up once in a blocked NameIndex of the
+    injured players, with a bonus for players injured that season.
+    Returns the linked names and their scores, lined up with dops.
+    '''
+    index = NameIndex()
+    players = inj[['Player', 'start_year']].drop_duplicates()
+    for player, year in players.itertuples(index=False, name=None):
+        index.add(None, player, season=year, key=player)
+    
+    victims = pd.DataFrame({'first':dops['vic_first_name'],
+                            'last':dops['vic_last_name'],
+                            'start_year':offense_start_years(dops)})
+    # Missing values (NA, NaN) become None, which the index treats as
+    # unknown, and which compare equal when the links are looked up
+    victims = victims.astype(object).where(victims.notna(), None)
+    links = {}
+    for first, last, year in victims.dropna(subset=['last']).drop_duplicates(
+            ).itertuples(index=False, name=None):
+        links[(first, last, year)] = index.best(first, last, season=year,
+                                                min_score=min_score)
+    linked = [links.get(row, (None, None))
+              for row in victims.itertuples(index=False, name=None)]
+    return pd.DataFrame(linked, index=dops.index,
+                        columns=['link_score', 'inj_player'])
+
+@timed('injuries', rows=len)
+def match_injuries(dops, inj, date_col=None, window_days=None, fuzzy=False):
+    '''
+    Joins every injury to the suspensions of the same victim in the same
+    season with one merge on (victim last name, season start year). Each
+    match is its own row, so several injuries in a season all show up.
+    
+    If the injury table has dates, date_col and window_days keep only the
+    injuries from the day of the offense to window_days after it.
+    
+    With fuzzy=True victims are joined through link_victims instead of by
+    exact last name, and each match carries its link_score.
+    '''
+    susp = pd.DataFrame({'victim':dops['vic_last_name'],
+                         'date':pd.to_datetime(dops['off_date']),
+                         'susp_act':dops['offense_cat'],
+                         'start_year':offense_start_years(dops)})
+    if fuzzy:
+        links = link_victims(dops, inj)
+        susp['victim'] = links['inj_player']
+        susp['link_score'] = links['link_score']
+    susp = susp.dropna(subset=['victim'])
+    
+    inj_cols = ['Player', 'start_year', 'Games Missed', 'Injury Type']
+    if date_col is not None:
+        inj_cols.append(date_col)
+    injuries = inj[inj_cols].rename(columns={'Player':'victim',
+                                             'Games Missed':'games_missed',
+                                             'Injury Type':'inj_type'})
+    
+    inj_connect = susp.merge(injuries, on=['victim', 'start_year'])
+    if date_col is not None and window_days is not None:
+        gap = pd.to_datetime(inj_connect[date_col]) - inj_connect['date']
+        inj_connect = inj_connect[(gap >= pd.Timedelta(0)) & 
+                                  (gap <= pd.Timedelta(days=window_days))]
+    extra = inj_cols[4:] + (['link_score'] if fuzzy else [])
+    return inj_connect[['victim', 'date', 'games_missed', 'inj_type',
+                        'susp_act'] + extra].reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    inj = load_injuries()
+    
+    # TODO: Change this to the new stats one
+    dops = load_frame(SCRUBBED)
+    
+    # TODO: Maybe get victim's team first
+    inj_connect = match_injuries(dops, inj, fuzzy='--fuzzy' in sys.argv)
+    info('%d injuries matched', len(inj_connect))
+    save_frame(inj_connect, INJURY_MATCHES, '--csv' in sys.argv)
@@ -0,0 +1,238 @@
+'''
+Timers, request and cache counters for the whole pipeline, and its log.
+
+Measuring is off unless DOPS_METRICS is set:
+    DOPS_METRICS=summary   print a summary table to stderr at exit
+    DOPS_METRICS=<path>    also append every measurement to path as a
+                           JSON line, and the summary as the last line
+While it is off every call returns straight away, so the hooks can stay
+in the hot loops.
+
+Messages go through the 'dops' logger: info() always shows, debug()
+only with DOPS_DEBUG=1. Dropped messages are never formatted.
+
+Only the main process is measured. Work done on a process pool shows up
+in the wall time of the timer around it, and in the children's RSS.
+'''
+
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+log = logging.getLogger('dops')
+debug = log.debug
+info = log.info
+
+
+class Span(object):
+    '''
+    What a timer block is measuring. Set rows inside the block when the
+    number of rows is only known at the end.
+    '''
+
+    def __init__(self, metrics, name, rows=0):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.wall,
+                              time.process_time() - self.cpu, self.rows)
+
+
+class NullSpan(object):
+    rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_SPAN = NullSpan()
+
+
+def peak_rss():
+    '''
+    Returns the peak resident memory of this process and of its finished
+    children, in MB
+    '''
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and in kB everywhere else
+    unit = 2**20 if sys.platform == 'darwin' else 2**10
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+class Metrics(object):
+    '''
+    Collects timings, requests and cache lookups. output is None (off),
+    'summary', or the path of a JSON lines file.
+    '''
+
+    def __init__(self, output=None):
+        self.enabled = bool(output)
+        self.path = output if output and output != 'summary' else None
+        self.lock = threading.Lock()
+        self.timers = defaultdict(lambda: [0, 0.0, 0.0, 0])  # calls, wall, cpu, rows
+        self.hosts = defaultdict(lambda: [0, 0, 0.0, 0])     # requests, bytes, seconds, errors
+        self.caches = defaultdict(lambda: [0, 0])            # hits, misses
+        self.started = time.perf_counter()
+
+    def emit(self, record):
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def timer(self, name, rows=0):
+        '''
+        Returns a context manager that times its block:
+            with timer('clean.dates', len(dops)):
+        '''
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, rows)
+
+    def add_time(self, name, wall, cpu, rows=0):
+        with self.lock:
+            timer = self.timers[name]
+            timer[0] += 1
+            timer[1] += wall
+            timer[2] += cpu
+            timer[3] += rows
+            self.emit({'type':'timer', 'name':name, 'wall':round(wall, 6),
+                       'cpu':round(cpu, 6), 'rows':rows})
+
+    def request(self, host, status, size, seconds):
+        '''
+        Counts one HTTP request. status is None if it never got an answer.
+        '''
+        if not self.enabled:
+            return
+        with self.lock:
+            counts = self.hosts[host]
+            counts[0] += 1
+            counts[1] += size
+            counts[2] += seconds
+            counts[3] += status is None or status >= 400
+            self.emit({'type':'request', 'host':host, 'status':status,
+                       'bytes':size, 'seconds':round(seconds, 6)})
+
+    def cache(self, name, hits=0, misses=0):
+        if not self.enabled:
+            return
+        with self.lock:
+            counts = self.caches[name]
+            counts[0] += hits
+            counts[1] += misses
+
+    def summary(self):
+        '''
+        Returns everything measured so far as one dictionary
+        '''
+        rss, children_rss = peak_rss()
+        with self.lock:
+            return {
+                'type':'summary',
+                'wall':round(time.perf_counter() - self.started, 3),
+                'peak_rss_mb':rss, 'children_peak_rss_mb':children_rss,
+                'timers':{name:{'calls':calls, 'wall':round(wall, 6),
+                                'cpu':round(cpu, 6), 'rows':rows,
+                                'rows_per_s':round(rows / wall, 1) if rows and wall else None}
+                          for name, (calls, wall, cpu, rows) in self.timers.items()},
+                'hosts':{host:{'requests':n, 'bytes':size, 'seconds':round(seconds, 6),
+                               'errors':errors}
+                         for host, (n, size, seconds, errors) in self.hosts.items()},
+                'caches':{name:{'hits':hits, 'misses':misses,
+                                'hit_ratio':round(hits / (hits + misses), 4)
+                                if hits + misses else None}
+                          for name, (hits, misses) in self.caches.items()},
+                }
+
+    def report(self, stream=sys.stderr):
+        '''
+        Prints the summary table, and appends the summary to the JSON
+        lines file if there is one
+        '''
+        summary = self.summary()
+        self.emit(summary)
+        lines = ['', '{:<32} {:>7} {:>10} {:>10} {:>10} {:>12}'.format(
+                'timer', 'calls', 'wall s', 'cpu s', 'rows', 'rows/s')]
+        for name, t in sorted(summary['timers'].items()):
+            lines.append('{:<32} {:>7} {:>10.3f} {:>10.3f} {:>10} {:>12}'.format(
+                    name, t['calls'], t['wall'], t['cpu'], t['rows'] or '',
+                    '{:,.0f}'.format(t['rows_per_s']) if t['rows_per_s'] else ''))
+        if summary['hosts']:
+            lines += ['', '{:<32} {:>7} {:>10} {:>10} {:>10}'.format(
+                    'host', 'requests', 'MB', 'avg s', 'errors')]
+            for host, h in sorted(summary['hosts'].items()):
+                lines.append('{:<32} {:>7} {:>10.2f} {:>10.3f} {:>10}'.format(
+                        host, h['requests'], h['bytes'] / 2**20,
+                        h['seconds'] / h['requests'], h['errors']))
+        if summary['caches']:
+            lines += ['', '{:<32} {:>7} {:>10} {:>10}'.format(
+                    'cache', 'hits', 'misses', 'hit ratio')]
+            for name, c in sorted(summary['caches'].items()):
+                lines.append('{:<32} {:>7} {:>10} {:>10}'.format(
+                        name, c['hits'], c['misses'],
+                        '{:.1%}'.format(c['hit_ratio'])
+                        if c['hit_ratio'] is not None else ''))
+        lines += ['', 'wall {:.1f}s'.format(summary['wall'])]
+        if summary['peak_rss_mb'] is not None:
+            lines[-1] += ', peak RSS {:.1f} MB (children {:.1f} MB)'.format(
+                    summary['peak_rss_mb'], summary['children_peak_rss_mb'])
+        print('\n'.join(lines), file=stream)
+
+
+metrics = Metrics(os.environ.get('DOPS_METRICS'))
+if metrics.enabled:
+    atexit.register(metrics.report)
+
+timer = metrics.timer
+count_request = metrics.request
+count_cache = metrics.cache
+
+
+def timed(name=None, rows=None):
+    '''
+    Decorator that times every call of a function. rows, if given, is
+    called on the result to count the rows it handled (len, say).
+    '''
+    def decorate(func):
+        label = name or func.__qualname__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with metrics.timer(label) as span:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    span.rows = rows(result)
+            return result
+        return wrapper
+    return decorate
+
+
+if not log.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if os.environ.get('DOPS_DEBUG') else logging.INFO)
+    log.propagate = False
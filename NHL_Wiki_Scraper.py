@@ -1,231 +1,415 @@
-import requests
-import numpy as np
-import pandas as pd
-from bs4 import BeautifulSoup
-
-url = 'https://en.wikipedia.org/wiki/'
-
-# Collect all the URL endings for the pages we want
-pages = ['{}–{}_NHL_suspensions_and_fines'.format(str(n-1), 
-         str(n)[-2:]) for n in range(2017, 2009, -1)]
-
-# Create our DataFrame and preload the columns we will use
-dops_df = pd.DataFrame(columns=('off_date', 'offender', 'off_team', 'offense', 
-                                'dops_date', 'susp', 'forfeit_sal', 'fine'))
-
-
-
-def suspension_table(table):
-    '''
-    This function goes through the Wikitables that hold data about player
-    suspensions. 
-    '''
-    rows = table.find_all('tr')
-    for row in rows[1:-1]:
-        td = row.find_all('td')
-        
-        # NOTE: Some tables had data in a span class, others just text
-        # which is why there are some try and except clauses.
-        
-        # td[0] holds Offense Date
-        try:
-            off_date = td[0].find('span',
-                     {'style':'white-space:nowrap'}).text
-        except AttributeError:
-            off_date = td[0].text
-        #td[1] holds the Offender's Name
-        try:
-            offender = td[1].find('span').text
-        except:
-            offender = td[1].text
-        # td[2] holds Offender's Team                 
-        off_team = td[2].text
-        # td[3] holds a description of the Offense.             
-        offense = td[3].text
-        # td[4] holds the day the suspension was given out
-        try:
-            dops_date = td[4].find('span',
-                     {'style':'white-space:nowrap'}).text
-        except AttributeError:
-            dops_date = td[4].text
-        # td[5] holds the length of the suspension
-        susp = td[5].text
-        # td[6] holds the amount of salary forfeited from the suspension                 
-        try:
-            forfeit_sal = td[6].text
-        except IndexError:
-            forfeit_sal = 'N/A'
-        # No fines so value is 0
-        fine = 0
-
-        # Store all the scraped values in the DataFrame                       
-        dops_df.loc[len(dops_df)] = [off_date, offender, off_team, 
-                               offense, dops_date, susp, forfeit_sal, fine]
-
-        
-
-def fines_table(table):
-    '''
-    This function goes through the tables that contain the fine data
-    found in Wikipedia tables. 
-    '''
-    rows = table.find_all('tr')
-    
-    # NOTE: Some tables used span classes while others used simple text
-    # which is why there are lots of try and except clauses
-    
-    for row in rows[1:-1]:
-        td = row.find_all('td')
-        # Get the date of offense
-        try:
-            off_date = td[0].find('span',
-                     {'style':'white-space:nowrap'}).text
-        except AttributeError:
-            off_date = td[0].text
-        # Get the offender's name            
-        try:
-            offender = td[1].find('span').text
-        except AttributeError:
-            offender = td[1].text
-        # Get offending team
-        off_team = td[2].text
-        # Get the offense
-        offense = td[3].text
-        # Get the day the DoPS made a decision
-        try:
-            dops_date = td[4].find('span',{'style':'white-space:nowrap'}).text
-        except AttributeError:
-            dops_date = td[4].text
-        susp = 0
-        forfeit_sal = 0
-        # Get the fine amount
-        fine = td[5].text
-                       
-        dops_df.loc[len(dops_df)] = [off_date, offender, off_team, 
-                               offense, dops_date, susp, forfeit_sal, fine]
-        
-def susp_table_oldstyle(table):
-    '''
-    Older Wikipedia tables did not have a column for the day the suspensions
-    were applied and this shifted the data around so a new function was made.
-    '''
-    
-    rows = table.find_all('tr')
-    for row in rows[1:]:
-        td = row.find_all('td')
-        # Get the date of offense
-        try:
-            off_date = td[0].find('span',
-                     {'style':'white-space:nowrap'}).text
-        except AttributeError:
-            off_date = td[0].text
-        # Get the offender's name            
-        try:
-            offender = td[1].find('span').text
-        except AttributeError:
-            offender = td[1].text
-        # Get offending team
-        off_team = td[2].text
-        # Get the offense
-        offense = td[3].text
-        # Get the day the DoPS made a decision
-        dops_date = np.nan
-        susp = td[4].text
-        forfeit_sal = np.nan
-        # Get the fine amount
-        fine = np.nan
-                       
-        dops_df.loc[len(dops_df)] = [off_date, offender, off_team, 
-                               offense, dops_date, susp, forfeit_sal, fine]
-        
-        
-def fines_table_oldstyle(table):
-    '''
-    Older Wikipedia tables did not contain the date which the fines were 
-    applied and this shifted the data around. As such, a new function was
-    created
-    '''
-    
-    rows = table.find_all('tr')
-    for row in rows[1:]:
-        td = row.find_all('td')
-        # Get the date of offense
-        try:
-            off_date = td[0].find('span',
-                     {'style':'white-space:nowrap'}).text
-        except AttributeError:
-            off_date = td[0].text
-        # Get the offender's name            
-        try:
-            offender = td[1].find('span').text
-        except AttributeError:
-            offender = td[1].text
-        # Get offending team
-        off_team = td[2].text
-        # Get the offense
-        offense = td[3].text
-        # Get the day the DoPS made a decision
-        dops_date = np.nan
-        susp = 0
-        forfeit_sal = np.nan
-        # Get the fine amount
-        fine = td[4].text
-                       
-        dops_df.loc[len(dops_df)] = [off_date, offender, off_team, 
-                               offense, dops_date, susp, forfeit_sal, fine]
-        
-
-def detect_page_table_type(page):
-    '''
-    Reads which year the Wiki pages covers and returns the appropriate 
-    number of table headers to read in. 
-    '''
-    header_count ={
-            '2016':[10,8],
-            '2015':[10,8],
-            '2014':[10,8],
-            '2013':[11,9],
-            '2012':[6,6],
-            '2011':[6,6],
-            '2010':[5,5],
-            '2009':[5,5],
-            }
-    
-    year = page[0:4]
-  
-    return header_count[year][0], header_count[year][1]
-
-# Scrape each Wiki page for it's tables
-for page in pages:
-    print(page)    
-    r = requests.get(url + page)
-    bs = BeautifulSoup(r.text, features='lxml-xml')
-    tables = bs.find_all('table',{'class':'wikitable sortable'})
-    
-    # Find the style of table by year
-    susp_len, fine_len = detect_page_table_type(page)
-    
-    # Extract the data according to table type
-    if susp_len > 6:
-        for table in tables:
-            headers = table.find_all('th')
-            if len(headers) == susp_len:
-                suspension_table(table)
-            elif len(headers) == fine_len:
-                fines_table(table)
-            else:
-                continue
-    elif susp_len == 6:
-        for table in tables:
-            # Fine and suspensions are of equal length
-            # Searching for length will determine type
-            if '<th>Length</th>' in str(table.find_all('th')):
-                suspension_table(table)
-            else:
-                fines_table(table)
-    else:
-        susp_table_oldstyle(tables[0])
-        fines_table_oldstyle(tables[1])
-    print(len(dops_df))
-        
-dops_df.to_csv('NHL_Suspensions.csv')
\ No newline at end of file
+import io
+import sys
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from lxml import etree
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Instrumentation import timed, count_cache, debug, info
+from Request_Scheduler import shared_scheduler
+from Storage import SUSPENSIONS, save_frame, load_frame
+
+url = 'https://en.wikipedia.org/wiki/'
+
+# Collect all the URL endings for the pages we want
+pages = ['{}–{}_NHL_suspensions_and_fines'.format(str(n-1), 
+         str(n)[-2:]) for n in range(2017, 2009, -1)]
+
+# Where incremental runs keep each page's ETag, Last-Modified and hashes
+STATE_FILE = 'NHL_Suspensions_state.json'
+
+# The columns we scrape, in the order the parsers fill them
+COLUMNS = ('off_date', 'offender', 'off_team', 'offense', 
+           'dops_date', 'susp', 'forfeit_sal', 'fine')
+
+
+class RecordBuilder(object):
+    '''
+    Collects scraped rows one column list at a time. The DataFrame is only
+    built once, when to_frame is called, instead of on every row.
+    '''
+    
+    def __init__(self, columns=COLUMNS):
+        self.columns = columns
+        self.data = {col: [] for col in columns}
+        
+    def add(self, *values):
+        '''
+        Appends one row. Values must be given in the order of the columns.
+        '''
+        for col, value in zip(self.columns, values):
+            self.data[col].append(value)
+            
+    def __len__(self):
+        return len(self.data[self.columns[0]])
+    
+    def to_frame(self):
+        return pd.DataFrame(self.data, columns=self.columns)
+
+
+# Keywords used to recognise each field from a table's header text. A header
+# is given to the first field, in this order, that contains one of its
+# keywords and has not been claimed yet. The first date column is always the
+# offense and the second one the day of the DoPS decision.
+HEADER_FIELDS = (
+        ('off_date', ('date',)),
+        ('dops_date', ('date',)),
+        ('offender', ('player', 'offender', 'name')),
+        ('off_team', ('team',)),
+        ('offense', ('offense', 'offence', 'infraction', 'reason')),
+        ('forfeit_sal', ('salary', 'forfeit')),
+        ('susp', ('length', 'suspension', 'games')),
+        ('fine', ('fine', 'amount')),
+        )
+
+# How the text of each field is read out of its cell
+FIELD_KINDS = {'off_date':'date', 'dops_date':'date', 'offender':'name'}
+
+# Cells that can be missing at the end of a row without skipping the row
+OPTIONAL_FIELDS = ('forfeit_sal',)
+
+
+def cell_text(td):
+    return td.text
+
+def date_text(td):
+    '''
+    Some tables keep the date in a nowrap span next to a hidden sort key
+    '''
+    span = td.find('span', {'style':'white-space:nowrap'})
+    return td.text if span is None else span.text
+
+def name_text(td):
+    '''
+    Some tables wrap the player's name in a span, others just use text
+    '''
+    span = td.find('span')
+    return td.text if span is None else span.text
+
+CELL_READERS = {'text':cell_text, 'date':date_text, 'name':name_text}
+
+# The same readers for lxml elements
+def lxml_text(elem):
+    '''
+    All the text inside an element, like bs4's .text. iterparse gives
+    plain etree elements, which have no text_content().
+    '''
+    return ''.join(elem.itertext())
+
+def lxml_cell_text(td):
+    return lxml_text(td)
+
+def lxml_date_text(td):
+    span = td.find(".//span[@style='white-space:nowrap']")
+    return lxml_text(td if span is None else span)
+
+def lxml_name_text(td):
+    span = td.find('.//span')
+    return lxml_text(td if span is None else span)
+
+LXML_READERS = {'text':lxml_cell_text, 'date':lxml_date_text,
+                'name':lxml_name_text}
+
+
+def map_headers(header_names):
+    '''
+    Input the text of a table's header cells
+    Returns a dictionary of field name -> column number
+    '''
+    mapping = {}
+    for col, name in enumerate(header_names):
+        name = name.strip().lower()
+        for field, keywords in HEADER_FIELDS:
+            if field in mapping:
+                continue
+            if any(word in name for word in keywords):
+                mapping[field] = col
+                break
+    return mapping
+
+
+class TablePlan(object):
+    '''
+    The extraction plan for one table, compiled once from its headers.
+    For every output column it holds either the cell to read and how to
+    read it, or the constant to fill in when the table has no such column.
+    '''
+    
+    def __init__(self, header_names, readers=CELL_READERS):
+        self.mapping = map_headers(header_names)
+        if 'susp' in self.mapping:
+            self.kind = 'suspension'
+        elif 'fine' in self.mapping:
+            self.kind = 'fine'
+        else:
+            self.kind = None
+            return
+        
+        # Older tables have no date of action, and leave the money columns
+        # they don't have empty rather than zero.
+        new_style = 'dops_date' in self.mapping
+        self.new_style = new_style
+        if self.kind == 'suspension':
+            defaults = {'fine':0 if new_style else np.nan,
+                        'forfeit_sal':'N/A' if new_style else np.nan}
+        else:
+            defaults = {'susp':0,
+                        'forfeit_sal':0 if new_style else np.nan}
+        if self.kind == 'suspension' and not new_style:
+            # These tables never reported forfeited salary
+            self.mapping.pop('forfeit_sal', None)
+        
+        self.steps = []
+        for field in COLUMNS:
+            col = self.mapping.get(field)
+            reader = readers[FIELD_KINDS.get(field, 'text')]
+            self.steps.append((col, reader, defaults.get(field, np.nan)))
+        
+        required = [col for field, col in self.mapping.items()
+                    if field not in OPTIONAL_FIELDS]
+        self.min_cells = max(required) + 1
+        
+    def body(self, rows):
+        '''
+        Input every row of the table
+        Returns the rows below the header. The last row of the newer tables
+        is left out too, as it always was: it's the totals row on most
+        pages, but on the 2011-12 and 2012-13 pages it's a real record.
+        Keeping that record would move the rows after it, which the
+        row numbers in CSV_cleaner.LEGACY_OVERRIDES point at.
+        '''
+        return rows[1:-1] if self.new_style else rows[1:]
+        
+    def run(self, rows, records):
+        '''
+        Input the rows of the table, as lists of cells, and a RecordBuilder
+        Rows that are too short to be data (headers, totals) are skipped
+        '''
+        for td in rows:
+            n_cells = len(td)
+            if n_cells < self.min_cells:
+                continue
+            records.add(*[default if col is None or col >= n_cells
+                          else reader(td[col])
+                          for col, reader, default in self.steps])
+            
+
+def extract_table(table, records):
+    '''
+    Reads the header names of a Wikitable, compiles its extraction plan and
+    adds its rows to records. Tables that hold neither suspensions nor fines
+    are ignored.
+    '''
+    rows = table.find_all('tr')
+    if not rows:
+        return
+    plan = TablePlan([th.text for th in rows[0].find_all('th')])
+    if plan.kind is None:
+        return
+    
+    # Header and totals rows are made of th cells and are left out
+    plan.run([row.find_all('td') for row in plan.body(rows)
+              if row.find('th') is None], records)
+
+def is_wikitable(elem):
+    classes = elem.get('class', '').split()
+    return 'wikitable' in classes and 'sortable' in classes
+
+def extract_tables_lxml(html, records):
+    '''
+    Streams the page through lxml and only keeps the sortable Wikitables.
+    Each one is read with the lxml cell readers and freed straight away,
+    and the rest of the article is dropped as the parser moves past it.
+    '''
+    data = html.encode('utf-8') if isinstance(html, str) else html
+    for _, table in etree.iterparse(io.BytesIO(data), events=('end',),
+                                    tag='table', html=True,
+                                    encoding='utf-8'):
+        if is_wikitable(table):
+            rows = list(table.iter('tr'))
+            if rows:
+                plan = TablePlan([lxml_text(th)
+                                  for th in rows[0].findall('th')],
+                                 readers=LXML_READERS)
+                if plan.kind is not None:
+                    plan.run([row.findall('td') for row in plan.body(rows)
+                              if row.find('th') is None], records)
+        table.clear()
+        while table.getprevious() is not None:
+            del table.getparent()[0]
+
+
+def fetch_pages(pages, ordered=False, headers=None, scheduler=None):
+    '''
+    Downloads every season page concurrently through the shared request
+    scheduler, which keeps to Wikipedia's rate and connection limits.
+    Yields (page, response) pairs as soon as they are ready: in the order
+    they finish, or in the order of pages if ordered is True.
+    headers can map a page to extra request headers for it.
+    '''
+    headers = headers or {}
+    scheduler = scheduler or shared_scheduler()
+    futures = {scheduler.submit(url + page, headers.get(page)):page
+               for page in pages}
+    finished = futures if ordered else as_completed(futures)
+    for future in finished:
+        r = future.result()
+        r.raise_for_status()
+        yield futures[future], r
+
+def season_of(page):
+    '''
+    Returns the season a page covers, e.g. '2016–17'
+    '''
+    return page.split('_')[0]
+
+@timed('parse_page', rows=len)
+def parse_page(page, html, parser='lxml'):
+    '''
+    Reads every suspension and fine table on one season page and returns
+    the rows as a DataFrame. Pages can be parsed in any order.
+    
+    parser='lxml' only keeps the Wikitables while parsing, parser='bs4'
+    builds BeautifulSoup objects for them.
+    '''
+    records = RecordBuilder()
+    if parser == 'lxml':
+        extract_tables_lxml(html, records)
+    else:
+        only_tables = SoupStrainer('table', {'class':'wikitable sortable'})
+        bs = BeautifulSoup(html, features='lxml-xml', parse_only=only_tables)
+        for table in bs.find_all('table',{'class':'wikitable sortable'}):
+            extract_table(table, records)
+    frame = records.to_frame()
+    frame['season'] = season_of(page)
+    return frame
+
+def scrape_seasons(pages, parser='lxml', processes=0):
+    '''
+    Downloads and parses every season page, parsing each one as soon as it
+    arrives. With processes > 0 the pages are parsed on a process pool.
+    Returns one DataFrame with the pages in their original order.
+    '''
+    frames = {}
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(parse_page, page, r.text, parser): page
+                       for page, r in fetch_pages(pages)}
+            for future in as_completed(futures):
+                frames[futures[future]] = future.result()
+                debug('%s: %d rows', futures[future],
+                      len(frames[futures[future]]))
+    else:
+        for page, r in fetch_pages(pages):
+            frames[page] = parse_page(page, r.text, parser)
+            debug('%s: %d rows', page, len(frames[page]))
+    return pd.concat([frames[page] for page in pages], ignore_index=True)
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_state(state, path=STATE_FILE):
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+def conditional_headers(entry):
+    '''
+    Builds the If-None-Match / If-Modified-Since headers for a page from
+    what the server sent the last time we downloaded it
+    '''
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def rows_digest(frame):
+    '''
+    Hash of the scraped rows themselves. Wikipedia's HTML changes for
+    reasons that don't touch the tables, so this is what decides whether
+    a season gets merged again.
+    '''
+    hashes = pd.util.hash_pandas_object(frame.astype(str), index=False)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()
+
+def scrape_incremental(pages, files=SUSPENSIONS, state_path=STATE_FILE,
+                       parser='lxml', csv=False):
+    '''
+    Re-scrapes only the seasons that changed since the last run.
+    Every page is requested conditionally. Pages that come back 304, or
+    whose content hash is unchanged, are not parsed. Pages that do get
+    parsed are only merged if their rows changed. The rows of the changed
+    seasons replace the old ones in files (see Storage.save_frame).
+    Returns the merged DataFrame.
+    '''
+    state = load_state(state_path)
+    try:
+        old = load_frame(files)
+    except FileNotFoundError:
+        old = None
+    if old is None or 'season' not in old.columns:
+        # Nothing we can merge into, so every season has to be scraped
+        old = None
+        state = {}
+    
+    headers = {page:conditional_headers(state.get(page, {})) 
+               for page in pages}
+    changed = {}
+    for page, r in fetch_pages(pages, headers=headers):
+        entry = state.get(page, {})
+        if r.status_code == 304:
+            debug('%s: not modified', page)
+            count_cache('season_pages', hits=1)
+            continue
+        
+        new_entry = {'etag':r.headers.get('ETag'),
+                     'last_modified':r.headers.get('Last-Modified'),
+                     'sha256':hashlib.sha256(r.content).hexdigest(),
+                     'rows_sha256':entry.get('rows_sha256')}
+        if new_entry['sha256'] != entry.get('sha256'):
+            frame = parse_page(page, r.text, parser)
+            new_entry['rows_sha256'] = rows_digest(frame)
+            if new_entry['rows_sha256'] != entry.get('rows_sha256'):
+                changed[page] = frame
+        state[page] = new_entry
+        debug('%s: %s', page, 'changed' if page in changed else 'unchanged')
+        count_cache('season_pages', hits=page not in changed,
+                    misses=page in changed)
+    
+    if old is not None and not changed:
+        save_state(state, state_path)
+        return old
+    
+    # Keep the seasons in page order, then anything older we still have
+    frames = []
+    seasons = [season_of(page) for page in pages]
+    for page, season in zip(pages, seasons):
+        if page in changed:
+            frames.append(changed[page])
+        elif old is not None:
+            frames.append(old[old['season'] == season])
+    if old is not None:
+        frames.append(old[~old['season'].isin(seasons)])
+    dops_df = pd.concat(frames, ignore_index=True)
+    
+    save_frame(dops_df, files, csv)
+    save_state(state, state_path)
+    return dops_df
+
+
+if __name__ == '__main__':
+    csv = '--csv' in sys.argv
+    if '--incremental' in sys.argv:
+        dops_df = scrape_incremental(pages, csv=csv)
+    else:
+        dops_df = scrape_seasons(pages)
+        save_frame(dops_df, SUSPENSIONS, csv)
+    info('%d rows scraped', len(dops_df))
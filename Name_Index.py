@@ -0,0 +1,184 @@
+'''
+Fuzzy linking of player names between data sets.
+
+Names are folded (see Name_Parser.fold_name) and filed under a few
+blocking keys: the Soundex code, first four letters and last four
+letters of the last name. A lookup only scores the names that share a
+block with it, so linking stays far below comparing every pair.
+'''
+
+import sys
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from Name_Parser import fold_name
+
+SOUNDEX_CODES = {letter:digit for digit, letters in (('1', 'bfpv'),
+                                                     ('2', 'cgjkqsxz'),
+                                                     ('3', 'dt'), ('4', 'l'),
+                                                     ('5', 'mn'), ('6', 'r'))
+                 for letter in letters}
+
+# How much each part of a match counts towards its score
+LAST_WEIGHT = 0.7
+FIRST_WEIGHT = 0.3
+SEASON_BONUS = 0.05
+TEAM_BONUS = 0.05
+
+# Victims' names as they were misspelt, and the (first, last) record each
+# should link to at the injury linking score, or None for no link. The
+# injury data only has last names, as on the last record.
+MISSPELLINGS = [
+        ((None, 'Suban'), ('P.K.', 'Subban')),
+        (('', 'Toes'), ('Jonathan', 'Toews')),
+        ((None, 'Zuker'), ('Jason', 'Zucker')),
+        (('Marc-Andre', 'Fluery'), ('Marc-Andre', 'Fleury')),
+        (('Erik', 'Karlson'), ('Erik', 'Karlsson')),
+        (('TJ', 'Oshie'), ('T.J.', 'Oshie')),
+        (('Andrew', 'DAgostini'), ('Andrew', "D'Agostini")),
+        (('Brad', 'Marchant'), ('Brad', 'Marchand')),
+        (('Kris', 'Latang'), ('Kris', 'Letang')),
+        (('Ryan', 'Getzlaff'), ('Ryan', 'Getzlaf')),
+        (('Niklas', 'Hjalmarson'), (None, 'Hjalmarsson')),
+        (('Sidney', 'Crosier'), None),
+        ]
+LINK_SCORE = 0.85
+
+
+def soundex(name):
+    '''
+    American Soundex code of a name: 'Robert' -> 'R163'
+    '''
+    name = fold_name(name)
+    if not name:
+        return ''
+    code = name[0].upper()
+    previous = SOUNDEX_CODES.get(name[0])
+    for letter in name[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+def blocking_keys(last_name):
+    '''
+    The blocks a last name is filed under. Two spellings of a name
+    usually agree on at least one of them.
+    '''
+    folded = fold_name(last_name)
+    if not folded:
+        return set()
+    return {'sx:' + soundex(folded), 'pf:' + folded[:4], 'sf:' + folded[-4:]}
+
+def similarity(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+def first_name_score(a, b):
+    '''
+    Compares two first names. Initials ('P.K.', 'TJ') only have to agree
+    on their first letter. Returns None if either name is missing.
+    '''
+    if not a or not b:
+        return None
+    a, b = fold_name(a), fold_name(b)
+    if not a or not b:
+        return None
+    if len(a) <= 2 or len(b) <= 2:
+        return 1.0 if a[0] == b[0] else 0.0
+    return similarity(a, b)
+
+def name_score(first_name, folded_last, r_first, r_last):
+    '''
+    Scores a name against a record's. Without a first name on both sides
+    the last names are all there is to go on, so the score is their
+    similarity alone rather than a guess at the first names.
+    '''
+    last = similarity(folded_last, r_last)
+    first = first_name_score(first_name, r_first)
+    if first is None:
+        return last
+    return LAST_WEIGHT * last + FIRST_WEIGHT * first
+
+
+class NameIndex(object):
+    '''
+    Holds (first, last, season, team) records under their blocking keys
+    and returns ranked, scored candidates for a name
+    '''
+
+    def __init__(self):
+        self.records = []
+        self.blocks = defaultdict(list)
+
+    def add(self, first_name, last_name, season=None, team=None, key=None):
+        '''
+        Adds a record. key is what candidates returns for it, the record's
+        position by default.
+        '''
+        position = len(self.records)
+        self.records.append((first_name, fold_name(last_name), season, team,
+                             position if key is None else key))
+        for block in blocking_keys(last_name):
+            self.blocks[block].append(position)
+
+    def candidates(self, first_name, last_name, season=None, team=None,
+                   limit=5, min_score=0.6):
+        '''
+        Returns up to limit (score, key) pairs, best first. Records with
+        the same key only appear once, with their best score.
+        '''
+        folded = fold_name(last_name)
+        positions = set()
+        for block in blocking_keys(last_name):
+            positions.update(self.blocks.get(block, ()))
+
+        best = {}
+        for position in positions:
+            r_first, r_last, r_season, r_team, key = self.records[position]
+            score = name_score(first_name, folded, r_first, r_last)
+            if season is not None and season == r_season:
+                score += SEASON_BONUS
+            if team is not None and team == r_team:
+                score += TEAM_BONUS
+            if score >= min_score and score > best.get(key, 0):
+                best[key] = score
+        ranked = sorted(((score, key) for key, score in best.items()),
+                        key=lambda pair: -pair[0])
+        return ranked[:limit]
+
+    def best(self, first_name, last_name, season=None, team=None,
+             min_score=0.6):
+        '''
+        Returns the best (score, key) pair, or (None, None)
+        '''
+        found = self.candidates(first_name, last_name, season, team,
+                                limit=1, min_score=min_score)
+        return found[0] if found else (None, None)
+
+
+def check_misspellings(min_score=LINK_SCORE):
+    '''
+    Looks every misspelling up in an index of the right names
+    Returns (name, expected, found) for those that don't link as expected
+    '''
+    index = NameIndex()
+    for name, record in MISSPELLINGS:
+        if record is not None:
+            index.add(*record, key=record)
+    failed = []
+    for name, record in MISSPELLINGS:
+        score, found = index.best(*name, min_score=min_score)
+        if found != record:
+            failed.append((name, record, found))
+    return failed
+
+
+if __name__ == '__main__':
+    failed = check_misspellings()
+    for name, record, found in failed:
+        print('{} linked to {}, expected {}'.format(name, found, record))
+    print('{} of {} misspellings linked as expected'.format(
+            len(MISSPELLINGS) - len(failed), len(MISSPELLINGS)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,121 @@
+'''
+Splits offender and victim names into first and last names.
+
+Every distinct name is parsed once and the result is kept in a memo that
+is saved between runs, so the cost grows with the number of different
+players rather than the number of rows.
+'''
+
+import json
+import re
+import unicodedata
+import pandas as pd
+
+from Instrumentation import timed, count_cache
+
+MEMO_FILE = 'name_memo.json'
+
+# Bump this when the parsing rules change so old memos are thrown away
+RULES_VERSION = 1
+
+NON_PLAYER = ['No Player Victim', 'Team', 'Organization']
+
+# 'Last, First' style names
+COMMA_LAST = re.compile(r'(\w+)[,]?\s\w+')
+COMMA_FIRST = re.compile(r'\w+[,]?\s(\w+)')
+
+# 'First Last' style names. Victims' last names may be D'Amigo style.
+FIRST = re.compile(r'(.*)\s\w+')
+OFF_LAST = re.compile(r'.*\s(\w+)')
+VIC_LAST = re.compile(r'.*\s([A-Z].\w+|\w+)')
+
+LAST_NAME_RE = {'offender':OFF_LAST, 'victim':VIC_LAST}
+
+
+def last_match(reg_exp, name):
+    found = reg_exp.findall(name)
+    return found[-1] if found else None
+
+def parse_name(name, kind='offender'):
+    '''
+    Input a player's name and whether it is an 'offender' or 'victim'
+    Returns (first name, last name, canonical 'First Last' name)
+    '''
+    if name in NON_PLAYER:
+        return None, None, None
+
+    if ',' in name:
+        last = last_match(COMMA_LAST, name)
+        first = last_match(COMMA_FIRST, name)
+    else:
+        last = last_match(LAST_NAME_RE[kind], name)
+        first = last_match(FIRST, name)
+
+    if first is None or last is None:
+        canonical = name.strip()
+    else:
+        canonical = '{} {}'.format(first.strip(), last.strip())
+    return first, last, canonical
+
+def fold_name(name):
+    '''
+    Reduces a name to lower case ASCII letters so that accents, hyphens,
+    spaces, periods and D'-style apostrophes don't stop two spellings of
+    the same name from matching: "D'Amigo" -> 'damigo', 'P.K.' -> 'pk'
+    '''
+    name = unicodedata.normalize('NFKD', name)
+    name = name.encode('ascii', 'ignore').decode('ascii').lower()
+    return re.sub(r'[^a-z]', '', name)
+
+def fold_column(names):
+    '''
+    fold_name for a whole column at once
+    '''
+    return (names.str.normalize('NFKD')
+            .str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.lower().str.replace(r'[^a-z]', '', regex=True))
+
+
+class NameParser(object):
+    '''
+    Parses name columns through a memo of every name seen so far.
+    Call save() to keep the memo for the next run.
+    '''
+
+    def __init__(self, memo_file=MEMO_FILE):
+        self.memo_file = memo_file
+        self.memo = {'offender':{}, 'victim':{}}
+        try:
+            with open(memo_file) as f:
+                memo = json.load(f)
+            if memo.get('version') == RULES_VERSION:
+                self.memo.update(memo['names'])
+        except FileNotFoundError:
+            pass
+
+    @timed('clean.names', rows=len)
+    def parse_column(self, names, kind='offender'):
+        '''
+        Input a column of names
+        Returns a DataFrame with the first, last and canonical name of each
+        row, lined up with the input
+        '''
+        memo = self.memo[kind]
+        names = names.astype(object)
+        distinct = names.dropna().unique()
+        new = [name for name in distinct if name not in memo]
+        for name in new:
+            memo[name] = parse_name(name, kind)
+        count_cache('name_memo', hits=len(distinct) - len(new),
+                    misses=len(new))
+
+        table = pd.DataFrame([memo[name] for name in distinct],
+                             index=distinct,
+                             columns=['first', 'last', 'canonical'])
+        parsed = table.reindex(names.values)
+        parsed.index = names.index
+        return parsed
+
+    def save(self):
+        with open(self.memo_file, 'w') as f:
+            json.dump({'version':RULES_VERSION, 'names':self.memo}, f)
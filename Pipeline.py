@@ -0,0 +1,250 @@
+'''
+Runs the whole project as one pipeline:
+
+    scrape -> clean -> stats
+                    -> injuries
+
+Every stage declares the files it reads and writes. Once a stage has
+run, its outputs are stored in ARTIFACT_DIR under a hash of its input
+files, its code and its options. The next time the stage comes up with
+the same hash its outputs are restored from there instead, so only the
+stages downstream of a change run again. Stages whose inputs are ready
+run at the same time.
+
+Run with: python Pipeline.py [--refresh] [--force] [--chunked] [--league] [--fuzzy] [--csv]
+    --refresh  re-scrape Wikipedia (only the seasons that changed)
+    --force    run every stage even if its outputs are stored
+    --chunked  clean in chunks on every core (see CSV_cleaner.clean_chunks)
+'''
+
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Instrumentation import timer, count_cache, info
+from Storage import SUSPENSIONS, SCRUBBED, STATS, INJURY_MATCHES, load_frame, save_frame
+
+ARTIFACT_DIR = 'artifacts'
+INJURIES = 'NHL_Injuries.csv'
+INJURY_SCRIPT = 'Injury Data Add (Later).py'
+OVERRIDES = 'DoPS_Overrides.csv'
+
+# Stages run on threads, next to the scheduler's threads, so their process
+# pools must not fork this process: a forked child only gets the thread
+# that forked it, and any lock another thread held stays locked for good
+PROCESS_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def file_digest(path):
+    '''
+    sha256 of a file's contents, or None if it doesn't exist
+    '''
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_script(path, name):
+    '''
+    Imports a script whose file name isn't a valid module name
+    '''
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def stage_files(files, csv):
+    '''
+    The files a stage writes for one of the Storage tables
+    '''
+    return list(files) if csv else [files[0]]
+
+
+class Stage(object):
+    '''
+    One step of the pipeline. run(**options) must read only the inputs
+    and write all of the outputs. code lists the source files whose
+    changes should make the stage run again.
+    '''
+
+    def __init__(self, name, run, inputs=(), outputs=(), code=(), options=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.options = options or {}
+
+    def key(self):
+        '''
+        Hash of everything the stage's outputs depend on. Only valid once
+        the stages it depends on have finished.
+        '''
+        digest = hashlib.sha256(self.name.encode())
+        for path in self.code + self.inputs:
+            digest.update('{}={}\n'.format(path, file_digest(path)).encode())
+        digest.update(json.dumps(self.options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def artifact(self, key, path):
+        return os.path.join(ARTIFACT_DIR, self.name, key, os.path.basename(path))
+
+    def restore(self, key):
+        '''
+        Puts the stored outputs for key in place
+        Returns False if they aren't all stored
+        '''
+        stored = [self.artifact(key, path) for path in self.outputs]
+        if not all(os.path.exists(path) for path in stored):
+            return False
+        for path, artifact in zip(self.outputs, stored):
+            if file_digest(path) != file_digest(artifact):
+                shutil.copy2(artifact, path)
+        return True
+
+    def store(self, key):
+        for path in self.outputs:
+            artifact = self.artifact(key, path)
+            os.makedirs(os.path.dirname(artifact), exist_ok=True)
+            shutil.copy2(path, artifact)
+
+    def execute(self, upstream=(), force=False):
+        '''
+        Waits for the stages this one reads from, then restores or runs it
+        Returns 'cached' or 'ran'
+        '''
+        for future in upstream:
+            future.result()
+        start = time.perf_counter()
+        with timer('stage.' + self.name):
+            key = self.key()
+            if not force and self.restore(key):
+                status = 'cached'
+            else:
+                self.run(**self.options)
+                self.store(key)
+                status = 'ran'
+        count_cache('stages', hits=status == 'cached',
+                    misses=status == 'ran')
+        info('{:<9} {:<6} {:8.2f}s'.format(self.name, status,
+                                           time.perf_counter() - start))
+        return status
+
+
+def run_pipeline(stages, force=(), workers=4):
+    '''
+    Input the stages in an order where each comes after the ones it
+    reads from, and the names of the stages to run even if stored
+    Runs each stage as soon as the stages producing its inputs are done
+    Returns {stage name: 'cached' or 'ran'}
+    '''
+    producers = {path:stage.name for stage in stages for path in stage.outputs}
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stage in stages:
+            upstream = [futures[producers[path]] for path in stage.inputs
+                        if path in producers]
+            futures[stage.name] = pool.submit(stage.execute, upstream,
+                                              stage.name in force)
+        return {name:future.result() for name, future in futures.items()}
+
+
+def scrape(csv=False):
+    import NHL_Wiki_Scraper
+    NHL_Wiki_Scraper.scrape_incremental(NHL_Wiki_Scraper.pages, csv=csv)
+
+def clean(chunked=False, csv=False):
+    import CSV_cleaner
+    if chunked:
+        CSV_cleaner.clean_chunks(csv=csv, mp_context=PROCESS_CONTEXT)
+    else:
+        save_frame(CSV_cleaner.clean(load_frame(SUSPENSIONS)), SCRUBBED, csv)
+
+def gamelog_ids(dops):
+    import Add_Stats
+    ids = [Add_Stats.href_ids(dops, offender) for offender in (True, False)]
+    for frame in ids:
+        frame = frame[frame.notna().all(axis=1)].astype({'year':int})
+        yield from frame.itertuples(index=False, name=None)
+
+def stats(league=False, csv=False):
+    '''
+    Player IDs come from the suggest service and the stats from
+    hockey-reference gamelogs (or the league tables with league=True).
+    The two downloads don't depend on each other, so they run at the
+    same time before the stats are attached. They go to different hosts,
+    which the scheduler queues separately, so the slow gamelog pages
+    don't hold up the suggest requests.
+    '''
+    import Add_Stats
+    dops = load_frame(SCRUBBED)
+    store = Add_Stats.GamelogStore()
+    league = Add_Stats.LeagueGames() if league else None
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ids = pool.submit(Add_Stats.nhl_scrape, dops.copy())
+        if league is None:
+            games = pool.submit(store.prefetch, list(gamelog_ids(dops)))
+        else:
+            years = Add_Stats.href_ids(dops)['year'].dropna().astype(int)
+            games = pool.submit(lambda: [league.season(year)
+                                         for year in years.unique()])
+        ids = ids.result()
+        games.result()
+    for who in ('vic', 'off'):
+        dops[who + '_nhl_id'] = ids[who + '_nhl_id']
+    dops = Add_Stats.attach_stats(dops, processes=os.cpu_count(),
+                                  store=store, league=league,
+                                  mp_context=PROCESS_CONTEXT)
+    save_frame(dops, STATS, csv)
+
+def injuries(fuzzy=False, csv=False):
+    script = load_script(INJURY_SCRIPT, 'injury_data')
+    inj_connect = script.match_injuries(load_frame(SCRUBBED),
+                                        script.load_injuries(INJURIES),
+                                        fuzzy=fuzzy)
+    save_frame(inj_connect, INJURY_MATCHES, csv)
+
+def build_stages(league=False, fuzzy=False, chunked=False, csv=False):
+    return [
+        Stage('scrape', scrape, outputs=stage_files(SUSPENSIONS, csv),
+              code=['NHL_Wiki_Scraper.py', 'Request_Scheduler.py',
+                    'Storage.py'],
+              options={'csv':csv}),
+        Stage('clean', clean, inputs=[SUSPENSIONS[0], OVERRIDES],
+              outputs=stage_files(SCRUBBED, csv),
+              code=['CSV_cleaner.py', 'Name_Parser.py', 'Storage.py'],
+              options={'chunked':chunked, 'csv':csv}),
+        Stage('stats', stats, inputs=[SCRUBBED[0]],
+              outputs=stage_files(STATS, csv),
+              code=['Add_Stats.py', 'Name_Parser.py', 'Request_Scheduler.py',
+                    'Storage.py'],
+              options={'league':league, 'csv':csv}),
+        Stage('injuries', injuries, inputs=[SCRUBBED[0], INJURIES],
+              outputs=stage_files(INJURY_MATCHES, csv),
+              code=[INJURY_SCRIPT, 'Name_Index.py', 'Name_Parser.py',
+                    'Storage.py'],
+              options={'fuzzy':fuzzy, 'csv':csv}),
+        ]
+
+
+if __name__ == '__main__':
+    stages = build_stages(league='--league' in sys.argv,
+                          fuzzy='--fuzzy' in sys.argv,
+                          chunked='--chunked' in sys.argv,
+                          csv='--csv' in sys.argv)
+    if '--force' in sys.argv:
+        force = [stage.name for stage in stages]
+    elif '--refresh' in sys.argv:
+        force = ['scrape']
+    else:
+        force = []
+    run_pipeline(stages, force)
@@ -0,0 +1,256 @@
+'''
+Records the responses the scrapers get and plays them back, so whole
+runs can be repeated without the network.
+
+Set DOPS_HTTP before a run to choose what the request scheduler's
+session talks to:
+    record  the network as usual, archiving every response
+    replay  the archive directly, with no network and no delay
+    serve   a stand-in server on localhost that serves the archive,
+            DOPS_LATENCY seconds late (give or take half) and failing
+            DOPS_ERROR_RATE of the requests with a 503
+DOPS_ARCHIVE names the archive, ARCHIVE by default.
+
+An archive is two files, both only ever appended to. <name>.bin holds
+the response bodies, each compressed on its own, and is read through
+mmap, so a replay only decompresses the bodies it asks for. <name>.idx
+holds one JSON line per response with its URL, status, headers and the
+place of its body in <name>.bin.
+'''
+
+import http.server
+import json
+import mmap
+import os
+import random
+import threading
+import time
+import zlib
+from urllib.parse import quote, unquote
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+ARCHIVE = 'http_archive'
+
+# The response headers kept with each body
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+# Responses not worth keeping: retries and conditional answers
+SKIPPED_STATUS = (304, 429, 500, 502, 503, 504)
+
+
+class ResponseArchive(object):
+    '''
+    Archived GET responses by URL. The latest response to a URL wins.
+    '''
+
+    def __init__(self, name=ARCHIVE):
+        self.data_path = name + '.bin'
+        self.index_path = name + '.idx'
+        self.lock = threading.Lock()
+        self.view = None
+        self.index = {}
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.index[entry['url']] = entry
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.index)
+
+    def put(self, url, status, headers, body):
+        packed = zlib.compress(body)
+        with self.lock:
+            with open(self.data_path, 'ab') as f:
+                offset = f.tell()
+                f.write(packed)
+            entry = {'url':url, 'status':status, 'headers':headers,
+                     'offset':offset, 'length':len(packed)}
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.index[url] = entry
+            # The map no longer covers the whole file
+            self.view = None
+
+    def get(self, url):
+        '''
+        Returns the index entry and body of url, or (None, None)
+        '''
+        entry = self.index.get(url)
+        if entry is None:
+            return None, None
+        with self.lock:
+            if self.view is None:
+                with open(self.data_path, 'rb') as f:
+                    self.view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            packed = self.view[entry['offset']:entry['offset'] + entry['length']]
+        return entry, zlib.decompress(packed)
+
+
+def replay(archive, url, headers):
+    '''
+    Input the archive and a request's URL and headers
+    Returns the (status, headers, body) to answer it with. A request
+    whose If-None-Match is the archived ETag gets a 304.
+    '''
+    entry, body = archive.get(url)
+    if entry is None:
+        return 404, {'Content-Type':'text/plain'}, b'Not in archive: ' + url.encode()
+    etag = entry['headers'].get('ETag')
+    if etag is not None and headers.get('If-None-Match') == etag:
+        return 304, {'ETag':etag}, b''
+    return entry['status'], entry['headers'], body
+
+def build_response(request, status, headers, body):
+    r = requests.Response()
+    r.status_code = status
+    r.headers = CaseInsensitiveDict(headers)
+    r._content = body
+    r.url = request.url
+    r.request = request
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    return r
+
+
+class RecordingAdapter(HTTPAdapter):
+    '''
+    Sends requests over the network and archives the responses
+    '''
+
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        r = super().send(request, **kwargs)
+        if request.method == 'GET' and r.status_code not in SKIPPED_STATUS:
+            self.archive.put(request.url, r.status_code,
+                             {name:r.headers[name] for name in KEPT_HEADERS
+                              if name in r.headers},
+                             r.content)
+        return r
+
+
+class ReplayAdapter(BaseAdapter):
+    '''
+    Answers every request from the archive without touching the network
+    '''
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        return build_response(request, *replay(self.archive, request.url,
+                                               request.headers))
+
+    def close(self):
+        pass
+
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves GET /<quoted URL> from the stand-in server's archive
+    '''
+    # Keep-alive, so the session's connection pools are used as for real
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        if stand_in.latency:
+            time.sleep(stand_in.latency * random.uniform(0.5, 1.5))
+        if random.random() < stand_in.error_rate:
+            status, headers, body = 503, {'Content-Type':'text/plain'}, b'Injected error'
+        else:
+            status, headers, body = replay(stand_in.archive,
+                                           unquote(self.path[1:]), self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(object):
+    '''
+    Serves an archive over HTTP on localhost from a background thread,
+    with latency seconds of delay (give or take half) on every response
+    and error_rate of them replaced by a 503
+    '''
+
+    def __init__(self, archive, latency=0.0, error_rate=0.0, port=0):
+        self.archive = archive
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port),
+                                                      ArchiveHandler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StandInAdapter(HTTPAdapter):
+    '''
+    Sends every request to the stand-in server instead of its host
+    '''
+
+    def __init__(self, stand_in, **kwargs):
+        super().__init__(**kwargs)
+        self.stand_in = stand_in
+
+    def send(self, request, **kwargs):
+        url = request.url
+        request = request.copy()
+        request.url = self.stand_in.base_url + quote(url, safe='')
+        r = super().send(request, **kwargs)
+        r.url = url
+        return r
+
+    def close(self):
+        super().close()
+        self.stand_in.close()
+
+
+def mount_archive(session, pool_maxsize=10):
+    '''
+    Mounts the adapter DOPS_HTTP asks for on session
+    Returns the mode, or None when requests go to the network as usual
+    '''
+    mode = os.environ.get('DOPS_HTTP')
+    if not mode:
+        return None
+    archive = ResponseArchive(os.environ.get('DOPS_ARCHIVE', ARCHIVE))
+    if mode == 'record':
+        adapter = RecordingAdapter(archive, pool_maxsize=pool_maxsize)
+    elif mode == 'replay':
+        adapter = ReplayAdapter(archive)
+    elif mode == 'serve':
+        stand_in = StandInServer(archive,
+                                 float(os.environ.get('DOPS_LATENCY', 0)),
+                                 float(os.environ.get('DOPS_ERROR_RATE', 0)))
+        adapter = StandInAdapter(stand_in, pool_maxsize=pool_maxsize)
+    else:
+        raise ValueError('DOPS_HTTP must be record, replay or serve, not '
+                         '{!r}'.format(mode))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return mode
@@ -0,0 +1,200 @@
+'''
+One place every scraper sends its HTTP requests through.
+
+Each host gets a token bucket that holds it to its allowed request rate,
+and its own few worker threads, one per connection it allows. A host
+that is slow or rate limited only ever holds up its own queue: requests
+to other hosts go ahead on their own workers. Requests that come back 429/5xx, or fail
+to connect, are retried with jittered exponential backoff. Identical
+requests that are already in flight share one response.
+'''
+
+import random
+import threading
+import time
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from Instrumentation import count_request
+from Request_Archive import mount_archive
+
+# Requests per second and open connections allowed for each host
+HOST_LIMITS = {
+        'en.wikipedia.org':(10, 4),
+        'suggest.svc.nhl.com':(2, 2),
+        'www.hockey-reference.com':(1/3, 1), # 20 requests a minute
+        }
+DEFAULT_LIMIT = (1, 2)
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Most connections (and worker threads) any one host gets
+MAX_WORKERS = 8
+
+# Replayed responses don't come from the real hosts, so they aren't
+# held to the real hosts' limits
+REPLAY_LIMIT = (1000000, MAX_WORKERS)
+
+
+class TokenBucket(object):
+    '''
+    Lets through `rate` requests a second on average, and up to `burst`
+    at once after a quiet spell
+    '''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        '''
+        Blocks until a token is free. Tokens are reserved under the lock
+        and waited for outside it, so waiting callers queue up in order.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def retry_after(r):
+    '''
+    Returns the seconds a Retry-After header asks us to wait, if any
+    '''
+    try:
+        return float(r.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler(object):
+    '''
+    Runs GET requests over one keep-alive session, on a small thread
+    pool per host. submit returns a Future of the response.
+    '''
+
+    def __init__(self, max_workers=MAX_WORKERS, host_limits=HOST_LIMITS,
+                 retries=5, backoff=0.5):
+        self.host_limits = host_limits
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+
+        adapter = HTTPAdapter(pool_connections=len(host_limits) + 1,
+                              pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # DOPS_HTTP can put the response archive in place of the network
+        self.transport = mount_archive(self.session, max_workers)
+        if self.transport in ('replay', 'serve'):
+            self.host_limits = {}
+            self.default_limit = REPLAY_LIMIT
+        else:
+            self.default_limit = DEFAULT_LIMIT
+
+        self.lock = threading.RLock()
+        self.hosts = {}
+        self.inflight = {}
+
+    def limits(self, host):
+        '''
+        Returns the token bucket and the thread pool of a host. The pool
+        has a thread per connection the host allows, so it also caps the
+        host's open connections.
+        '''
+        with self.lock:
+            if host not in self.hosts:
+                rate, connections = self.host_limits.get(host,
+                                                         self.default_limit)
+                self.hosts[host] = (TokenBucket(rate), ThreadPoolExecutor(
+                        max_workers=min(connections, self.max_workers),
+                        thread_name_prefix=host))
+            return self.hosts[host]
+
+    def fetch(self, url, headers=None):
+        '''
+        Sends one request on one of its host's threads, waiting for the
+        host's rate limit, and retries it with jittered backoff when it
+        fails
+        '''
+        host = urlsplit(url).netloc
+        bucket = self.limits(host)[0]
+        for attempt in range(self.retries + 1):
+            bucket.take()
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, headers=headers, timeout=30)
+            except (requests.ConnectionError, requests.Timeout):
+                count_request(host, None, 0, time.perf_counter() - start)
+                if attempt == self.retries:
+                    raise
+                r = None
+            else:
+                count_request(host, r.status_code, len(r.content),
+                              time.perf_counter() - start)
+            if r is not None and (r.status_code not in RETRY_STATUS
+                                  or attempt == self.retries):
+                return r
+
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            if r is not None:
+                delay = max(delay, retry_after(r) or 0)
+            time.sleep(delay)
+
+    def submit(self, url, headers=None):
+        '''
+        Queues a GET request on its host's pool and returns a Future of
+        its response. If the same request is already queued or running,
+        its Future is returned instead of sending it twice.
+        '''
+        key = (url, tuple(sorted((headers or {}).items())))
+        pool = self.limits(urlsplit(url).netloc)[1]
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is None:
+                future = pool.submit(self.fetch, url, headers)
+                self.inflight[key] = future
+                future.add_done_callback(lambda f: self.finished(key))
+            return future
+
+    def finished(self, key):
+        with self.lock:
+            self.inflight.pop(key, None)
+
+    def get(self, url, headers=None):
+        return self.submit(url, headers).result()
+
+    def get_all(self, urls, headers=None):
+        '''
+        Requests every URL at once and yields (url, response) pairs as
+        they finish. headers can map a URL to extra request headers.
+        '''
+        headers = headers or {}
+        futures = {self.submit(url, headers.get(url)):url for url in urls}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+shared = None
+shared_lock = threading.Lock()
+
+def shared_scheduler():
+    '''
+    Returns the scheduler every scraper in this process shares, so the
+    per-host limits hold across all of them
+    '''
+    global shared
+    with shared_lock:
+        if shared is None:
+            shared = RequestScheduler()
+        return shared
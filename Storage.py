@@ -0,0 +1,153 @@
+'''
+How the pipeline's tables are handed from one stage to the next.
+
+Tables are saved as Parquet so their dtypes come back as they were
+written: dates stay datetimes, the repeated text columns are
+categoricals and integers use the smallest type that holds them.
+A CSV copy can still be written for looking at in a spreadsheet.
+'''
+
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# (Parquet file, CSV file) of each stage's output
+SUSPENSIONS = ('NHL_Suspensions.parquet', 'NHL_Suspensions.csv')
+SCRUBBED = ('Scrubbed.parquet', 'Scrubbed_CSV.csv')
+STATS = ('Stats.parquet', 'Stats_CSV.csv')
+INJURY_MATCHES = ('Injury_Connect.parquet', 'Injury_Connect.csv')
+
+# Columns with few distinct values, stored as categoricals
+CATEGORICAL = ['offender', 'off_team', 'offense_cat', 'victim']
+
+
+def compact(df, shrink=True):
+    '''
+    Returns a copy of the table with any mixed text column made all text
+    so it can be written to Parquet. With shrink, the CATEGORICAL columns
+    also become categoricals and integer columns are downcast.
+    '''
+    df = df.copy()
+    for col in df.columns:
+        if col in CATEGORICAL and shrink:
+            df[col] = df[col].astype('category')
+        elif df[col].dtype == object or col in CATEGORICAL:
+            values = df[col].astype(object)
+            df[col] = values.where(values.isna(), values.astype(str))
+        elif shrink and pd.api.types.is_integer_dtype(df[col].dtype) and \
+                not pd.api.types.is_extension_array_dtype(df[col].dtype):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def save_frame(df, files, csv=False):
+    '''
+    Writes the table to the Parquet file of files, and to its CSV file
+    as well if csv is True
+    '''
+    parquet_path, csv_path = files
+    compact(df).to_parquet(parquet_path)
+    if csv:
+        df.to_csv(csv_path)
+
+def csv_encoding(path):
+    '''
+    The encoding to read a CSV file with: UTF-8, as save_frame and
+    FrameWriter write it, or latin1 for an older file that isn't UTF-8.
+    The whole file is checked, so a chunked read can't fail halfway.
+    '''
+    try:
+        with open(path, encoding='utf-8') as f:
+            while f.read(2**20):
+                pass
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+def load_frame(files):
+    '''
+    Reads a table back from its Parquet file, or from its CSV file if
+    there's no Parquet file (a run from before the switch)
+    '''
+    parquet_path, csv_path = files
+    if os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path)
+    else:
+        df = pd.read_csv(csv_path, index_col=0,
+                         encoding=csv_encoding(csv_path))
+    # Tables written in chunks store these as plain text
+    for col in CATEGORICAL:
+        if col in df and df[col].dtype != 'category':
+            df[col] = df[col].astype('category')
+    return df
+
+def iter_frames(files, chunksize):
+    '''
+    Reads a table back chunksize rows at a time, from its Parquet file or
+    else its CSV file. Every chunk keeps the row labels it has in the
+    whole table.
+    '''
+    parquet_path, csv_path = files
+    if not os.path.exists(parquet_path):
+        yield from pd.read_csv(csv_path, index_col=0,
+                               encoding=csv_encoding(csv_path),
+                               chunksize=chunksize)
+        return
+    offset = 0
+    for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=chunksize):
+        chunk = batch.to_pandas()
+        if '__index_level_0__' in chunk:
+            chunk = chunk.set_index('__index_level_0__')
+            chunk.index.name = None
+        else:
+            # A range index is only kept in the file's metadata
+            chunk.index += offset
+        offset += len(chunk)
+        yield chunk
+
+
+class FrameWriter(object):
+    '''
+    Writes a table to files one chunk at a time, so it never has to be
+    in memory whole. Every chunk must have the columns of the first.
+    Integers aren't downcast and categoricals are stored as text, as
+    chunks could disagree on them; load_frame turns the text back into
+    categoricals.
+    '''
+
+    def __init__(self, files, csv=False):
+        self.parquet_path, self.csv_path = files
+        self.csv = csv
+        self.writer = None
+        self.written = False
+
+    def write(self, chunk):
+        table = compact(chunk, shrink=False)
+        if self.writer is None:
+            schema = pa.Schema.from_pandas(table, preserve_index=True)
+            # A column with nothing in it yet is taken to be text
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(pa.string()))
+            self.writer = pq.ParquetWriter(self.parquet_path, schema)
+        for field in self.writer.schema:
+            if pa.types.is_string(field.type) and field.name in table and \
+                    table[field.name].dtype != object:
+                values = table[field.name].astype(object)
+                table[field.name] = values.where(values.isna(), values.astype(str))
+        self.writer.write_table(pa.Table.from_pandas(
+                table, schema=self.writer.schema, preserve_index=True))
+        if self.csv:
+            chunk.to_csv(self.csv_path, mode='a' if self.written else 'w',
+                         header=not self.written)
+        self.written = True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()